@@ -0,0 +1,138 @@
+import zlib
+import numpy as np
+import torch
+
+# Positions with more legal moves than this are not cached
+MAX_CACHED_MOVES = 80
+WAYS = 4
+BUSY = -1 # Key of a slot being written, neither a match nor free for other writers
+
+class EvalCache():
+    # Bounded cache from a position's 64-bit hash to its policy over legal moves and its value.
+    # Entries live in fixed tensors (4-way sets, clock eviction inside a set), so share_memory()
+    # lets every self-play process read and fill the same cache.
+    # Writers aren't locked against each other, a checksum over each entry turns torn or mixed writes into misses.
+
+    def __init__(self, memory_mb=64):
+        entry_bytes = 8 + 8 + 4 + 2 + 1 + MAX_CACHED_MOVES * (2 + 2)
+        self.num_sets = max(int(memory_mb * 2**20) // (entry_bytes * WAYS), 1)
+        capacity = self.num_sets * WAYS
+
+        self.keys = torch.zeros(capacity, dtype=torch.int64)
+        self.values = torch.zeros(capacity, dtype=torch.float32)
+        self.counts = torch.zeros(capacity, dtype=torch.int16)
+        self.referenced = torch.zeros(capacity, dtype=torch.uint8)
+        self.checksums = torch.zeros(capacity, dtype=torch.int64)
+        self.moves = torch.zeros((capacity, MAX_CACHED_MOVES), dtype=torch.int16)
+        self.priors = torch.zeros((capacity, MAX_CACHED_MOVES), dtype=torch.float16)
+        self.counters = torch.zeros(3, dtype=torch.int64) # hits, misses, evictions
+        self._views()
+
+    def _views(self):
+        # numpy views share the tensors' memory and are much cheaper for single element access
+        self._keys, self._values, self._counts = self.keys.numpy(), self.values.numpy(), self.counts.numpy()
+        self._referenced, self._moves, self._priors = self.referenced.numpy(), self.moves.numpy(), self.priors.numpy()
+        self._counters, self._checksums = self.counters.numpy(), self.checksums.numpy()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_keys", "_values", "_counts", "_referenced", "_moves", "_priors", "_counters", "_checksums"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def share_memory(self):
+        for tensor in (self.keys, self.values, self.counts, self.referenced, self.moves, self.priors, self.counters,
+                       self.checksums):
+            tensor.share_memory_()
+        self._views() # share_memory_ moves the storage, the old views would point at freed memory
+        return self
+
+    def get(self, key, legal_moves=None):
+        # Returns (moves, priors, value) or None. With legal_moves an entry for a different move list
+        # (a hash collision) is a miss too.
+        key = _slot_key(key)
+        first = (key % self.num_sets) * WAYS
+        for slot in range(first, first + WAYS):
+            if self._keys[slot] == key:
+                count = int(self._counts[slot])
+                if not 0 <= count <= MAX_CACHED_MOVES:
+                    break
+                moves = self._moves[slot, :count].copy()
+                priors = self._priors[slot, :count].copy()
+                value = self._values[slot]
+                checksum = self._checksums[slot]
+
+                # Another process may have replaced the entry while it was read, or two writers mixed it
+                if self._keys[slot] != key or checksum != _checksum(key, moves, priors, value):
+                    break
+                moves = moves.tolist()
+                if legal_moves is not None and moves != list(legal_moves):
+                    break
+                self._referenced[slot] = 1
+                self._counters[0] += 1
+                return moves, priors.astype(np.float32), float(value)
+
+        self._counters[1] += 1
+        return None
+
+    def put(self, key, moves, priors, value):
+        if len(moves) > MAX_CACHED_MOVES:
+            return
+        key = _slot_key(key)
+        first = (key % self.num_sets) * WAYS
+
+        # Reuse the key's slot or an empty one, otherwise give referenced entries a second chance
+        slot = None
+        for candidate in range(first, first + WAYS):
+            if self._keys[candidate] == key or self._keys[candidate] == 0:
+                slot = candidate
+                break
+        if slot is None:
+            while slot is None:
+                for candidate in range(first, first + WAYS):
+                    if self._referenced[candidate]:
+                        self._referenced[candidate] = 0
+                    else:
+                        slot = candidate
+                        break
+            self._counters[2] += 1
+
+        # Payload first and the key last, so readers never match a half-written entry
+        self._keys[slot] = BUSY
+        count = len(moves)
+        moves = np.asarray(moves, dtype=np.int16)
+        priors = np.asarray(priors, dtype=np.float16)
+        value = np.float32(value)
+        self._moves[slot, :count] = moves
+        self._priors[slot, :count] = priors
+        self._counts[slot] = count
+        self._values[slot] = value
+        self._checksums[slot] = _checksum(key, moves, priors, value)
+        self._referenced[slot] = 0
+        self._keys[slot] = key
+
+    def stats(self):
+        hits, misses, evictions = (int(counter) for counter in self._counters)
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "capacity": len(self._keys),
+        }
+
+def _slot_key(key):
+    # Zobrist keys are unsigned 64-bit, stored as int64 with 0 reserved for empty slots
+    if key >= 1 << 63:
+        key -= 1 << 64
+    return key if key not in (0, BUSY) else 1
+
+def _checksum(key, moves, priors, value):
+    # Over everything a reader uses, moves and priors as stored (int16, float16)
+    checksum = zlib.crc32(moves.tobytes(), zlib.crc32(priors.tobytes(), zlib.crc32(np.float32(value).tobytes())))
+    return (checksum << 31) ^ (len(moves) << 16) ^ (key & 0x7FFFFFFF) # Fits in int64
@@ -0,0 +1,175 @@
+import os
+import queue
+import re
+import threading
+import time
+import torch
+
+CHECKPOINT_DIR = os.path.join("model", "checkpoints")
+MODEL_PATH = os.path.join("model", "goldfish_model.pt")
+LATEST_NAME = "LATEST"
+GENERATION_FILE = re.compile(r"gen_(\d+)\.pt$")
+
+def _atomic_save(obj, path):
+    torch.save(obj, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def _atomic_write_text(text, path):
+    with open(path + ".tmp", "w") as file:
+        file.write(text)
+    os.replace(path + ".tmp", path)
+
+def _cpu_copy(state):
+    # Snapshot of a (possibly nested) state dict, so training can keep updating the originals
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: _cpu_copy(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_cpu_copy(value) for value in state)
+    return state
+
+def read_latest(directory=CHECKPOINT_DIR):
+    try:
+        with open(os.path.join(directory, LATEST_NAME)) as file:
+            return int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class CheckpointRegistry():
+    # Numbered generations of model + optimizer state under directory. save() snapshots the state and returns,
+    # a background thread writes it with a rename so readers only ever see complete files.
+    # Retention keeps the newest keep_last generations plus every keep_every-th one.
+    # The newest weights are also published to publish_path for readers of the fixed model file.
+
+    def __init__(self, directory=CHECKPOINT_DIR, keep_last=5, keep_every=None, publish_path=MODEL_PATH):
+        self.directory = directory
+        self.keep_last = max(keep_last, 1)
+        self.keep_every = keep_every
+        self.publish_path = publish_path
+        os.makedirs(directory, exist_ok=True)
+
+        self.generation = max(self.generations(), default=0)
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def generations(self):
+        found = (GENERATION_FILE.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in found if match)
+
+    def path(self, generation):
+        return os.path.join(self.directory, f"gen_{generation:06d}.pt")
+
+    def save(self, model, optimizer=None, extra=None):
+        # Returns the new generation number, the file appears once the background write finishes
+        if self._error:
+            raise self._error
+        self.generation += 1
+        checkpoint = {
+            "generation": self.generation,
+            "time": time.time(),
+            "model": _cpu_copy(model.state_dict()),
+            "optimizer": _cpu_copy(optimizer.state_dict()) if optimizer is not None else None,
+            "extra": extra or {},
+        }
+        self._queue.put(checkpoint)
+        return self.generation
+
+    def wait(self):
+        # Blocks until every queued save is on disk
+        self._queue.join()
+        if self._error:
+            raise self._error
+
+    def load(self, generation=None, map_location="cpu"):
+        generation = generation or read_latest(self.directory) or max(self.generations(), default=None)
+        if generation is None:
+            return None
+        return torch.load(self.path(generation), map_location=map_location)
+
+    def _write_loop(self):
+        while True:
+            checkpoint = self._queue.get()
+            try:
+                _atomic_save(checkpoint, self.path(checkpoint["generation"]))
+                if self.publish_path:
+                    os.makedirs(os.path.dirname(self.publish_path) or ".", exist_ok=True)
+                    _atomic_save(checkpoint["model"], self.publish_path)
+                _atomic_write_text(str(checkpoint["generation"]), os.path.join(self.directory, LATEST_NAME))
+                self._apply_retention()
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _apply_retention(self):
+        generations = self.generations()
+        keep = set(generations[-self.keep_last:])
+        if self.keep_every:
+            keep.update(generation for generation in generations if generation % self.keep_every == 0)
+        for generation in generations:
+            if generation not in keep:
+                try:
+                    os.remove(self.path(generation))
+                except FileNotFoundError:
+                    pass
+
+
+def resume(registry, model, optimizer=None, device=torch.device("cpu")):
+    # Loads the newest generation, or the plain published weights from before the registry existed.
+    # Returns the generation, 0 for the published weights, None when there was nothing to load.
+    checkpoint = registry.load(map_location=device)
+    if checkpoint is not None:
+        model.load_state_dict(checkpoint["model"])
+        if optimizer is not None and checkpoint["optimizer"] is not None:
+            optimizer.load_state_dict(checkpoint["optimizer"])
+        return checkpoint["generation"]
+    if registry.publish_path and os.path.exists(registry.publish_path):
+        model.load_state_dict(torch.load(registry.publish_path, map_location=device))
+        return 0
+    return None
+
+
+class CheckpointWatcher():
+    # Polls a registry directory and loads newer generations into an existing model in place,
+    # so callers keep their module (and its imports) and only the weights change.
+
+    def __init__(self, model, directory=CHECKPOINT_DIR, interval=1.0, generation=None):
+        self.model = model
+        self.directory = directory
+        self.interval = interval
+        self.generation = generation # Already loaded, e.g. read_latest() when the model came from MODEL_PATH
+        self._checked = 0.0
+        self._stamp = None
+
+    def poll(self, force=False):
+        # Returns the newly loaded generation, or None when nothing changed
+        now = time.monotonic()
+        if not force and now - self._checked < self.interval:
+            return None
+        self._checked = now
+
+        try:
+            stamp = os.stat(os.path.join(self.directory, LATEST_NAME)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if stamp == self._stamp:
+            return None
+
+        generation = read_latest(self.directory)
+        if generation is None or generation == self.generation:
+            self._stamp = stamp
+            return None
+        try:
+            checkpoint = torch.load(os.path.join(self.directory, f"gen_{generation:06d}.pt"), map_location="cpu")
+        except FileNotFoundError:
+            return None # Retention removed it, a newer LATEST is on its way
+
+        with torch.no_grad():
+            self.model.load_state_dict(checkpoint["model"])
+        self.generation = generation
+        self._stamp = stamp
+        return generation
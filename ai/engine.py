@@ -1,20 +1,25 @@
-import os
-import uuid
 import torch
 
-from game.board import ChessBoard
+from game.board import create_board
 from game.state import encode_board_state
 from ai.model import GoldfishModel
+from ai.mcts import MCTS
 from ai.utils import *
 
 class Engine():
 
-    def __init__(self, device: torch.device, debug=False):
+    def __init__(self, device: torch.device, debug=False, backend="mailbox", model: GoldfishModel = None, simulations=0,
+                 cache=None, checkpoints=None):
         self.debug = debug
         self.device = device
-        self.game = ChessBoard() # Starts new board
-        self.model = GoldfishModel().to(self.device)
+        self.game = create_board(backend) # Starts new board
+        self.model = model or GoldfishModel().to(self.device)
         self.play_data = []
+        self.cache = cache # Optional ai.cache.EvalCache shared with MCTS
+        self.checkpoints = checkpoints # Optional ai.checkpoints.CheckpointWatcher on self.model
+
+        # With a simulation budget moves come from MCTS visit counts instead of the raw policy
+        self.mcts = MCTS(self.model, self.device, simulations, cache=cache) if simulations else None
 
         self.self_play()
         self.save_game_data()
@@ -22,65 +27,56 @@ class Engine():
     def self_play(self):
         while not self.game.is_game_over():
 
-            # Encode board
-            with torch.no_grad():
-                tensor = torch.tensor(encode_board_state(self.game)).permute(2, 0, 1).unsqueeze(0).float().to(self.device)
-
-                # Run the Goldfish model
-                output = self.model.forward(tensor)
+            # New weights between moves, the search tree was built with the old ones
+            if self.checkpoints and self.checkpoints.poll() is not None:
+                if self.debug: print(f"Loaded checkpoint generation {self.checkpoints.generation}")
+                if self.mcts: self.mcts.reset()
 
-            # Mask logits, get probabilities
-            legal_mask = get_all_legal_moves_4096(self.game)
-            logits = output["policy"].squeeze(0)
+            # Encode board
+            tensor = torch.from_numpy(encode_board_state(self.game)).unsqueeze(0).to(self.device)
 
-            mask_tensor = torch.tensor(legal_mask, dtype=torch.bool, device=logits.device)
-            masked_logits = torch.full_like(logits, float('-inf'))
-            masked_logits[mask_tensor] = logits[mask_tensor]
+            if self.mcts:
+                self.mcts.search(self.game)
+                indices, probabilities = self.mcts.policy_target()
+                move_index = self.mcts.best_move()
+            else:
+                evaluation = cached_probabilities(self.cache, self.game) if self.cache else None
+                if evaluation is None:
+                    # Run the Goldfish model
+                    with torch.no_grad():
+                        output = self.model.forward(tensor)
 
-            probabilities = torch.softmax(masked_logits, dim=0)
+                    # Softmax over the legal moves' logits
+                    evaluation = legal_softmax(output["policy"].squeeze(0), self.game)
+                    if self.cache: cache_evaluation(self.cache, self.game, *evaluation, output["value"].item())
+                indices, probabilities = evaluation
 
-            # argmax or multinominal, uncomment the to use
-            move_index = torch.argmax(probabilities).item()
-            # move_index = torch.multinomial(probabilities, num_samples=1).item()
+                # argmax or multinominal, uncomment the to use
+                move_index = indices[torch.argmax(probabilities)].item()
+                # move_index = indices[torch.multinomial(probabilities, num_samples=1)].item()
 
-            # Play move and store the move
-            from_row, from_col, to_row, to_col = decoder(move_index)
-            legal_moves = self.game.get_legal_moves(from_row, from_col)
-            if (to_row, to_col) in legal_moves:
+            # Play move and store the move, a bare policy index promotes to a queen
+            if move_index in self.game.legal_moves():
                 self.play_data.append({
                     "player": self.game.turn,
                     "state": tensor.detach().cpu(),
-                    "policy": probabilities.detach().cpu()
+                    "policy_index": indices.cpu(),
+                    "policy_prob": probabilities.detach().cpu()
                 })
-                self.game.make_move(from_row, from_col, to_row, to_col, legal_moves)
+                self.game.push(move_index)
+                if self.mcts: self.mcts.advance(move_index)
             else:
                 print("Illigal move!")
                 break
             
         # Game ended, compute result
-        result = self.game.result
-
-        if result == "checkmate":
-            winner = "b" if self.game.turn == "w" else "w"
-        elif result == "stalemate" or (result and result.startswith("draw")):
-            winner = None
-        else:
-            raise ValueError("Unexpected game result format: " + str(result))
+        winner = get_winner(self.game)
         
-        if self.debug: print(f"Game result: {result}, Winner: {winner}")
+        if self.debug: print(f"Game result: {self.game.result}, Winner: {winner}")
         
         # Attach value to each data in stored game
-        for data in self.play_data:
-            if winner is None:
-                data["value"] = 0 # Draw
-            else:
-                data["value"] = 1 if data["player"] == winner else -1
+        assign_values(self.play_data, winner)
 
     def save_game_data(self, max_games=1000):
-        os.makedirs("data", exist_ok=True)
-        filename = f"data/training_game_{uuid.uuid4().hex}.pt"
-        torch.save(self.play_data, filename)
-        if self.debug: print(f"Saved {len(self.play_data)} training samples to {filename}")
-
-        # Cleanup
-        cleanup_data(max_files=max_games)
\ No newline at end of file
+        filename = write_game_file(self.play_data, max_files=max_games)
+        if self.debug: print(f"Saved {len(self.play_data)} training samples to {filename}")
\ No newline at end of file
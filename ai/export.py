@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import random
+import time
+import warnings
+import numpy as np
+import torch
+
+from game.board import create_board
+from game.state import encode_batch
+from ai.model import GoldfishModel
+
+MODEL_PATH = os.path.join("model", "goldfish_model.pt")
+REPORT_NAME = "goldfish_export.json"
+ARTIFACTS = {
+    "torchscript": "goldfish_model.ts.pt",
+    "int8": "goldfish_model.int8.ts.pt",
+    "onnx": "goldfish_model.onnx",
+}
+MIN_TOP1_AGREEMENT = 0.95
+MAX_VALUE_ERROR = 0.05
+
+def load_fp32_model(path=MODEL_PATH, device=torch.device("cpu")):
+    model = GoldfishModel().to(device)
+    if os.path.exists(path):
+        model.load_state_dict(torch.load(path, map_location=device))
+    model.eval()
+    return model
+
+def _trace(model):
+    # TorchScript is deprecated upstream but still the lightest frozen artifact, hide its warnings
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.simplefilter("ignore")
+        return torch.jit.freeze(torch.jit.trace(model, torch.zeros(1, 18, 8, 8), strict=False))
+
+def export_torchscript(model, path):
+    traced = _trace(model)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        torch.jit.save(traced, path)
+
+def export_int8(model, path):
+    # Dynamic quantization of the linear layers, policy_fc is most of the CPU time
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from torch.ao.quantization import quantize_dynamic
+        quantized = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        torch.jit.save(_trace(quantized), path)
+
+def export_onnx(model, path):
+    torch.onnx.export(model, (torch.zeros(1, 18, 8, 8),), path, input_names=["state"],
+                      output_names=["policy", "value"], dynamic_axes={"state": {0: "batch"}})
+
+
+class OnnxModel():
+    # onnxruntime session behind the GoldfishModel call signature
+    def __init__(self, path):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def __call__(self, states):
+        policy, value = self.session.run(None, {"state": states.float().cpu().numpy()})
+        return {"policy": torch.from_numpy(policy), "value": torch.from_numpy(value)}
+
+    def eval(self):
+        return self
+
+
+def load_variant(name, model_dir="model"):
+    if name == "fp32":
+        return load_fp32_model(os.path.join(model_dir, "goldfish_model.pt"))
+    path = os.path.join(model_dir, ARTIFACTS[name])
+    if name == "onnx":
+        return OnnxModel(path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return torch.jit.load(path, map_location="cpu")
+
+def load_inference_model(model_dir="model"):
+    # Fastest exported CPU variant that agreed with fp32 and is newer than the weights, else the eager model.
+    # Returns (model, variant name). Only the GUI's AI loads models this way, training and self-play need eager
+    # weights they can update.
+    weights = os.path.join(model_dir, "goldfish_model.pt")
+    try:
+        with open(os.path.join(model_dir, REPORT_NAME)) as file:
+            report = json.load(file)
+    except (FileNotFoundError, ValueError):
+        report = {}
+
+    candidates = []
+    for name, result in report.get("variants", {}).items():
+        path = os.path.join(model_dir, ARTIFACTS.get(name, ""))
+        if name == "fp32" or not result.get("agrees") or not os.path.exists(path):
+            continue
+        if os.path.exists(weights) and os.path.getmtime(path) < os.path.getmtime(weights):
+            continue # Exported from older weights
+        candidates.append((result["latency_ms"], name))
+
+    for _, name in sorted(candidates):
+        try:
+            return load_variant(name, model_dir), name
+        except (ImportError, RuntimeError):
+            continue # e.g. onnxruntime missing on this machine
+    return load_fp32_model(weights), "fp32"
+
+def sample_positions(count=256, seed=0, max_plies=80):
+    # Positions from seeded random games, a stand-in for what self-play and search see
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        board = create_board("bitboard")
+        for _ in range(rng.randrange(max_plies)):
+            moves = board.legal_moves()
+            if not moves or board.is_game_over():
+                break
+            board.push(rng.choice(moves))
+        if board.legal_moves():
+            boards.append(board)
+    return boards
+
+def check_agreement(reference, model, boards):
+    # Top-1 legal move agreement and the largest value difference against the fp32 model
+    states = torch.from_numpy(encode_batch(boards))
+    with torch.no_grad():
+        expected, output = reference(states), model(states)
+
+    matches = 0
+    for i, board in enumerate(boards):
+        indices = [move & 4095 for move in board.legal_moves()]
+        if indices[int(torch.argmax(expected["policy"][i, indices]))] == indices[int(torch.argmax(output["policy"][i, indices]))]:
+            matches += 1
+    value_error = (expected["value"].float() - output["value"].float()).abs().max().item()
+    return matches / len(boards), value_error
+
+def benchmark(model, runs=200, batch=64, batch_runs=20):
+    # Median batch 1 latency in ms and batch throughput in positions/s
+    single = torch.randn(1, 18, 8, 8).clamp(0, 1)
+    states = torch.randn(batch, 18, 8, 8).clamp(0, 1)
+    with torch.no_grad():
+        for _ in range(10):
+            model(single)
+            model(states)
+
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(single)
+            times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(batch_runs):
+            model(states)
+        throughput = batch * batch_runs / (time.perf_counter() - start)
+    return float(np.median(times)) * 1000, throughput
+
+def export_all(model_path=MODEL_PATH, model_dir="model", onnx=True):
+    os.makedirs(model_dir, exist_ok=True)
+    model = load_fp32_model(model_path)
+
+    exporters = {"torchscript": export_torchscript, "int8": export_int8}
+    if onnx:
+        exporters["onnx"] = export_onnx
+
+    variants = {"fp32": model}
+    for name, export in exporters.items():
+        path = os.path.join(model_dir, ARTIFACTS[name])
+        try:
+            export(model, path)
+            variants[name] = load_variant(name, model_dir)
+        except (ImportError, ModuleNotFoundError, RuntimeError) as error:
+            print(f"{name:<12} skipped: {error}")
+
+    boards = sample_positions()
+    results = {}
+    for name, variant in variants.items():
+        top1, value_error = check_agreement(model, variant, boards)
+        latency, throughput = benchmark(variant)
+        agrees = top1 >= MIN_TOP1_AGREEMENT and value_error <= MAX_VALUE_ERROR
+        results[name] = {"latency_ms": latency, "throughput": throughput, "top1_agreement": top1,
+                         "max_value_error": value_error, "agrees": agrees}
+        print(f"{name:<12} batch 1 {latency:7.3f} ms  batch 64 {throughput:9.0f} pos/s  "
+              f"top-1 {top1:6.1%}  value err {value_error:.4f}  {'ok' if agrees else 'REJECTED'}")
+
+    with open(os.path.join(model_dir, REPORT_NAME), "w") as file:
+        json.dump({"variants": results}, file, indent=2)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="app.py export", description="Export inference artifacts and benchmark them")
+    parser.add_argument("--model", default=MODEL_PATH, help="fp32 weights to export")
+    parser.add_argument("--out-dir", default="model")
+    parser.add_argument("--no-onnx", action="store_true")
+    args = parser.parse_args(argv)
+
+    torch.manual_seed(0)
+    export_all(args.model, args.out_dir, onnx=not args.no_onnx)
+    fastest = load_inference_model(args.out_dir)[1]
+    print(f"GUI AI will use: {fastest}")
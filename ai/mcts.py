@@ -0,0 +1,191 @@
+import math
+import numpy as np
+import torch
+
+from ai.model import GoldfishModel
+from ai.utils import move_priors
+
+class Node():
+    __slots__ = ("prior", "visits", "value_sum", "children", "terminal_value")
+
+    def __init__(self, prior):
+        self.prior = prior
+        self.visits = 0
+        self.value_sum = 0.0    # From the point of view of the player who moved into this node
+        self.children = None    # Compact move -> Node once expanded
+        self.terminal_value = None
+
+
+class MCTS():
+    # PUCT search over a single ChessBoard using push/pop. Leaves are collected under virtual loss and
+    # evaluated together, and the subtree under the played move is kept for the next search.
+
+    def __init__(self, model: GoldfishModel, device: torch.device, simulations=200, batch_size=8, c_puct=1.5,
+                 dirichlet_alpha=0.3, noise_fraction=0.25, virtual_loss=1, cache=None):
+        self.model = model
+        self.device = device
+        self.simulations = simulations
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.dirichlet_alpha = dirichlet_alpha
+        self.noise_fraction = noise_fraction
+        self.virtual_loss = virtual_loss
+        self.cache = cache # Optional ai.cache.EvalCache, hits skip the network
+
+        self.root = None
+        self._noised_root = None
+
+    def reset(self):
+        self.root = None
+
+    def advance(self, move):
+        # Keep the subtree of the move that was played, if it was explored
+        if self.root is not None and self.root.children and move in self.root.children:
+            self.root = self.root.children[move]
+        else:
+            self.root = None
+
+    def search(self, board, simulations=None):
+        simulations = simulations or self.simulations
+        if self.root is None:
+            self.root = Node(1.0)
+        root = self.root
+
+        if root.children is None:
+            value = self._lookup(root, board)
+            if value is None:
+                value = self._evaluate([(root, board.hash, board.planes.copy(), board.legal_moves())])[0]
+            self._backpropagate([root], value)
+
+        if self.noise_fraction and root is not self._noised_root and root.children:
+            self._add_noise(root)
+
+        done = 0
+        while done < simulations:
+            leaves, paths = [], []
+            pending = set()
+
+            while len(leaves) < self.batch_size and done < simulations:
+                node, path, depth = self._select(board)
+
+                if node.terminal_value is None and node.children is None and board.is_game_over():
+                    node.children = {}
+                    node.terminal_value = -1.0 if board.result == "checkmate" else 0.0
+
+                if node.terminal_value is not None:
+                    self._undo(board, depth)
+                    self._backpropagate(path, node.terminal_value)
+                    done += 1
+                    continue
+
+                value = self._lookup(node, board)
+                if value is not None:
+                    self._undo(board, depth)
+                    self._backpropagate(path, value)
+                    done += 1
+                    continue
+
+                if id(node) in pending:
+                    # Virtual loss didn't steer this selection away, evaluate what we have
+                    self._undo(board, depth)
+                    break
+
+                self._apply_virtual_loss(path, 1)
+                leaves.append((node, board.hash, board.planes.copy(), board.legal_moves()))
+                paths.append(path)
+                pending.add(id(node))
+                self._undo(board, depth)
+                done += 1
+
+            if leaves:
+                values = self._evaluate(leaves)
+                for path, value in zip(paths, values):
+                    self._apply_virtual_loss(path, -1)
+                    self._backpropagate(path, value)
+
+        return root
+
+    def policy_target(self):
+        # (indices, probabilities) from the visit counts, underpromotions add to their queen promotion's index
+        visits = {}
+        for move, child in self.root.children.items():
+            visits[move & 4095] = visits.get(move & 4095, 0) + child.visits
+        target = torch.tensor(list(visits.values()), dtype=torch.float32)
+        return torch.tensor(list(visits.keys()), dtype=torch.int64), target / target.sum()
+
+    def best_move(self, temperature=0.0):
+        moves = list(self.root.children)
+        visits = np.array([self.root.children[move].visits for move in moves], dtype=np.float64)
+        if temperature <= 0:
+            return moves[int(np.argmax(visits))]
+        weights = visits ** (1.0 / temperature)
+        return moves[np.random.choice(len(moves), p=weights / weights.sum())]
+
+    def _select(self, board):
+        node = self.root
+        path = [node]
+        depth = 0
+        while node.children:
+            sqrt_visits = math.sqrt(node.visits)
+            best_score, best_move, best_child = -math.inf, None, None
+            for move, child in node.children.items():
+                q = child.value_sum / child.visits if child.visits else 0.0
+                score = q + self.c_puct * child.prior * sqrt_visits / (1 + child.visits)
+                if score > best_score:
+                    best_score, best_move, best_child = score, move, child
+
+            board.push(best_move)
+            depth += 1
+            node = best_child
+            path.append(node)
+        return node, path, depth
+
+    def _undo(self, board, depth):
+        for _ in range(depth):
+            board.pop()
+
+    def _apply_virtual_loss(self, path, sign):
+        # Counts pending leaves as lost visits so the next selections spread over other lines
+        loss = self.virtual_loss * sign
+        for node in path:
+            node.visits += loss
+            node.value_sum -= loss
+
+    def _backpropagate(self, path, value):
+        # value is for the side to move at the leaf, each node stores it for the player who moved into it
+        for node in reversed(path):
+            value = -value
+            node.visits += 1
+            node.value_sum += value
+
+    def _lookup(self, node, board):
+        # Expands the node from the cache, returns its value or None on a miss
+        if self.cache is None:
+            return None
+        entry = self.cache.get(board.hash, board.legal_moves())
+        if entry is None:
+            return None
+        moves, priors, value = entry
+        node.children = {move: Node(prior) for move, prior in zip(moves, priors.tolist())}
+        return value
+
+    def _evaluate(self, leaves):
+        states = torch.from_numpy(np.stack([planes for _, _, planes, _ in leaves])).to(self.device)
+        with torch.no_grad():
+            output = self.model(states)
+        logits = output["policy"].float().cpu()
+        values = output["value"].float().cpu().squeeze(1).tolist()
+
+        for (node, key, _, moves), row, value in zip(leaves, logits, values):
+            priors = move_priors(row, moves)
+            node.children = {move: Node(prior) for move, prior in zip(moves, priors.tolist())}
+            if self.cache is not None:
+                self.cache.put(key, moves, priors.numpy(), value)
+        return values
+
+    def _add_noise(self, root):
+        children = list(root.children.values())
+        noise = np.random.dirichlet([self.dirichlet_alpha] * len(children))
+        for child, eta in zip(children, noise):
+            child.prior = (1 - self.noise_fraction) * child.prior + self.noise_fraction * eta
+        self._noised_root = root
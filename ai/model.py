@@ -1,5 +1,7 @@
 import torch, torch.nn as nn, torch.nn.functional as F
 
+from tools.instrument import timed
+
 class GoldfishModel(nn.Module):
 
     def __init__(self):
@@ -19,6 +21,7 @@ class GoldfishModel(nn.Module):
         self.value_fc1 = nn.Linear(8 * 8, 64)
         self.value_fc2 = nn.Linear(64, 1)
 
+    @timed()
     def forward(self, x):
 
         # Shared convolutional layers
@@ -28,12 +31,12 @@ class GoldfishModel(nn.Module):
 
         # Policy Head
         p = F.relu(self.policy_conv(x))
-        p = p.view(p.size(0), -1)
+        p = p.flatten(1) # Works for channels_last activations too
         p = self.policy_fc(p)
 
         # Value Head
         v = F.relu(self.value_conv(x))
-        v = v.view(v.size(0), -1)
+        v = v.flatten(1)
         v = F.relu(self.value_fc1(v))
         v = torch.tanh(self.value_fc2(v))
 
@@ -0,0 +1,131 @@
+import time
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader
+
+from ai.model import GoldfishModel
+from ai.selfplay import BatchedSelfPlay
+from ai.replay import ReplayBuffer, ReplayDataset, ReplaySampler, prefetch
+from ai.checkpoints import CHECKPOINT_DIR, CheckpointRegistry, CheckpointWatcher, resume
+from ai.utils import seed_worker
+
+class TrainingPipeline():
+    # Self-play generators run in background processes and write shards while the trainer consumes them.
+    # The sample-reuse ratio (samples trained / samples generated) is kept between min_reuse and max_reuse:
+    # the trainer waits for data above max_reuse, generators pause below min_reuse unless the trainer is waiting.
+    # Generators hot-swap to every checkpoint generation the trainer saves.
+
+    def __init__(self, num_generators=1, games_per_round=8, batch_size=32, batches_per_chunk=50, max_reuse=8.0,
+                 min_reuse=1.0, warmup_samples=2048, replay_capacity=200_000, recency_half_life=None,
+                 backend="bitboard", sample=True, data_dir="data", max_games=1000,
+                 checkpoint_dir=CHECKPOINT_DIR, keep_checkpoints=5, simulations=0, fast=False):
+        self.num_generators = num_generators
+        self.games_per_round = games_per_round
+        self.batch_size = batch_size
+        self.batches_per_chunk = batches_per_chunk
+        self.max_reuse = max_reuse
+        self.min_reuse = min_reuse
+        self.warmup_samples = warmup_samples
+        self.replay_capacity = replay_capacity
+        self.recency_half_life = recency_half_life
+        self.backend = backend
+        self.sample = sample
+        self.data_dir = data_dir
+        self.max_games = max_games
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_checkpoints = keep_checkpoints
+        self.simulations = simulations
+        self.fast = fast
+
+    def run(self, chunks=100):
+        from ai.train import train_one_epoch, train_one_epoch_fast, prepare_fast_training
+
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model = GoldfishModel().to(device)
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+        checkpoints = CheckpointRegistry(self.checkpoint_dir, keep_last=self.keep_checkpoints)
+        generation = resume(checkpoints, model, optimizer, device)
+        if generation is not None:
+            print(f"Loaded existing model (generation {generation}).")
+        else:
+            # Generators start from whatever the trainer starts from
+            checkpoints.save(model, optimizer)
+            checkpoints.wait()
+        if self.fast:
+            train_model, scaler = prepare_fast_training(model, device)
+
+        ctx = mp.get_context("spawn")
+        stop = ctx.Event()
+        starved = ctx.Event() # Set while the trainer waits for data, generators never pause then
+        ingested = ctx.Value("q", 0, lock=False)
+        trained = ctx.Value("q", 0, lock=False)
+        generators = [ctx.Process(target=_generator, daemon=True, args=(
+            self.checkpoint_dir, self.data_dir, self.games_per_round, self.backend, self.sample, self.max_games,
+            stop, starved, ingested, trained, self.min_reuse, self.warmup_samples, self.simulations)) for _ in range(self.num_generators)]
+        for process in generators:
+            process.start()
+
+        replay = ReplayBuffer(self.replay_capacity, self.recency_half_life)
+        chunk = 0
+        waited = 0.0
+        try:
+            while chunk < chunks:
+                replay.update(self.data_dir)
+                ingested.value = replay.written
+
+                # Wait for data while the buffer is too small or training would reuse samples too often
+                chunk_samples = self.batches_per_chunk * self.batch_size
+                if len(replay) < self.warmup_samples or trained.value + chunk_samples > self.max_reuse * replay.written:
+                    # Only the generators can add samples, without them this would wait forever
+                    failed = [process for process in generators if process.exitcode is not None]
+                    if failed:
+                        raise RuntimeError(f"Self-play generator {failed[0].name} exited with code {failed[0].exitcode}, "
+                                           f"{replay.written} samples generated, {trained.value} trained")
+                    starved.set()
+                    time.sleep(0.1)
+                    waited += 0.1
+                    continue
+                starved.clear()
+
+                loader = DataLoader(ReplayDataset(replay), batch_size=None, pin_memory=device.type == "cuda",
+                                    sampler=ReplaySampler(replay, self.batch_size, self.batches_per_chunk, drop_last=True))
+                if self.fast:
+                    train_one_epoch_fast(train_model, prefetch(loader), optimizer, device, chunk, scaler)
+                else:
+                    train_one_epoch(model, prefetch(loader), optimizer, device, chunk)
+                trained.value += chunk_samples
+                checkpoints.save(model, optimizer, {"chunk": chunk, "trained": trained.value})
+
+                print(f"Chunk {chunk}: {replay.written} samples generated, {trained.value} trained "
+                      f"(reuse {trained.value / replay.written:.2f}), trainer waited {waited:.1f}s")
+                chunk += 1
+                waited = 0.0
+        finally:
+            checkpoints.wait()
+            stop.set()
+            for process in generators:
+                process.join(timeout=60)
+                if process.is_alive():
+                    process.terminate()
+
+
+def _generator(checkpoint_dir, data_dir, games_per_round, backend, sample, max_games, stop, starved, ingested, trained,
+               min_reuse, warmup_samples, simulations):
+    seed_worker()
+
+    model = GoldfishModel()
+    model.eval()
+    self_play = BatchedSelfPlay(torch.device("cpu"), model, batch_size=games_per_round, backend=backend,
+                                sample=sample, data_dir=data_dir, max_games=max_games, simulations=simulations)
+    watcher = CheckpointWatcher(model, checkpoint_dir, interval=0)
+    while not stop.is_set():
+        # Pick up new weights between rounds
+        watcher.poll()
+
+        # Pause while the trainer hasn't caught up with what was already generated, unless it is waiting for more.
+        # With a chunk larger than (max_reuse - min_reuse) * samples both limits can hold at once
+        if ingested.value > warmup_samples and trained.value < min_reuse * ingested.value and not starved.is_set():
+            time.sleep(0.2)
+            continue
+
+        self_play.play(games_per_round)
@@ -0,0 +1,202 @@
+import os
+import queue
+import time
+import torch
+import torch.multiprocessing as mp
+
+from game.board import create_board
+from ai.model import GoldfishModel
+from ai.cache import EvalCache
+from ai.mcts import MCTS
+from ai.shards import ShardWriter
+from ai.utils import *
+
+class SelfPlayPool():
+    # Worker processes play games, inference servers own the model and answer their workers in batches.
+    # Positions and outputs travel through shared-memory tensors, the queues only carry slot numbers.
+    # With cache_mb set, all workers share one evaluation cache for the duration of a play() call.
+    # With simulations set, workers run MCTS and train on its visit counts, every leaf goes through their server.
+
+    def __init__(self, model: GoldfishModel, num_workers=None, workers_per_server=8, max_batch=None, max_wait=0.002,
+                 device=torch.device("cpu"), backend="bitboard", sample=False, data_dir="data", max_games=1000,
+                 cache_mb=0, simulations=0):
+        self.model = model
+        self.num_workers = num_workers or max(os.cpu_count() - 1, 1)
+        self.workers_per_server = workers_per_server
+        self.max_batch = max_batch or workers_per_server
+        self.max_wait = max_wait
+        self.device = device
+        self.backend = backend
+        self.sample = sample
+        self.data_dir = data_dir
+        self.max_games = max_games
+        self.cache_mb = cache_mb
+        self.simulations = simulations
+        self.cache_stats = None
+
+    def play(self, num_games):
+        ctx = mp.get_context("spawn")
+        state_dict = {name: tensor.detach().cpu() for name, tensor in self.model.state_dict().items()}
+        # Fresh every call, entries are only valid for the weights they were computed with
+        cache = EvalCache(self.cache_mb).share_memory() if self.cache_mb else None
+
+        tasks = ctx.Queue()
+        results = ctx.Queue()
+        for _ in range(num_games):
+            tasks.put(True)
+        for _ in range(self.num_workers):
+            tasks.put(None)
+
+        # Started processes drop their args, so the shared objects are kept alive here until join
+        processes = []
+        channels = []
+        for first in range(0, self.num_workers, self.workers_per_server):
+            group = min(self.workers_per_server, self.num_workers - first)
+            inputs = torch.zeros((group, 18, 8, 8)).share_memory_()
+            policies = torch.zeros((group, 4096)).share_memory_()
+            values = torch.zeros(group).share_memory_()
+            requests = ctx.Queue()
+            ready = [ctx.Event() for _ in range(group)]
+            channels.append((requests, ready, inputs, policies, values))
+
+            processes.append(ctx.Process(target=_inference_server, args=(
+                state_dict, str(self.device), requests, inputs, policies, values, ready,
+                group, self.max_batch, self.max_wait)))
+            for index in range(group):
+                processes.append(ctx.Process(target=_self_play_worker, args=(
+                    index, tasks, results, requests, inputs, policies, values, ready[index], cache,
+                    self.backend, self.sample, self.data_dir, self.max_games, self.simulations)))
+
+        for process in processes:
+            process.start()
+
+        try:
+            game_results = _collect(results, processes, num_games)
+        except RuntimeError:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+            raise
+
+        for process in processes:
+            process.join()
+        if cache is not None:
+            self.cache_stats = cache.stats()
+        return game_results
+
+
+def _collect(results, processes, num_games, poll=1.0):
+    # Polls so a crashed worker or server raises instead of leaving play() waiting forever for its games
+    game_results = []
+    while len(game_results) < num_games:
+        try:
+            game_results.append(results.get(timeout=poll))
+        except queue.Empty:
+            failed = [process for process in processes if process.exitcode not in (None, 0)]
+            if failed:
+                raise RuntimeError(f"Self-play process {failed[0].name} exited with code {failed[0].exitcode}, "
+                                   f"{len(game_results)} of {num_games} games finished")
+    return game_results
+
+def _inference_server(state_dict, device_name, requests, inputs, policies, values, ready, num_workers, max_batch, max_wait):
+    device = torch.device(device_name)
+    model = GoldfishModel().to(device)
+    model.load_state_dict(state_dict)
+    model.eval()
+
+    active = num_workers
+    while active:
+        # Block for the first request, then coalesce more until the batch is full or max_wait has passed
+        slots = [requests.get()]
+        deadline = time.monotonic() + max_wait
+        while len(slots) < max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                slots.append(requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        active -= slots.count(None)
+        slots = [slot for slot in slots if slot is not None]
+        if not slots:
+            continue
+
+        with torch.no_grad():
+            output = model(inputs[slots].to(device))
+        policies[slots] = output["policy"].float().cpu()
+        values[slots] = output["value"].float().cpu().squeeze(1)
+
+        for slot in slots:
+            ready[slot].set()
+
+class _ServerModel():
+    # Stands in for the model inside a worker, each position goes through the worker's slot on its server
+
+    def __init__(self, index, requests, inputs, policies, values, ready):
+        self.index = index
+        self.requests = requests
+        self.inputs = inputs
+        self.policies = policies
+        self.values = values
+        self.ready = ready
+
+    def __call__(self, states):
+        policies, values = [], []
+        for state in states:
+            self.inputs[self.index].copy_(state)
+            self.ready.clear()
+            self.requests.put(self.index)
+            self.ready.wait()
+            policies.append(self.policies[self.index].clone())
+            values.append(self.values[self.index].clone())
+        return {"policy": torch.stack(policies), "value": torch.stack(values).unsqueeze(1)}
+
+def _self_play_worker(index, tasks, results, requests, inputs, policies, values, ready, cache, backend, sample, data_dir,
+                      max_games, simulations):
+    seed_worker()
+    writer = ShardWriter(data_dir, max_games=max_games)
+    model = _ServerModel(index, requests, inputs, policies, values, ready)
+    # The worker has one slot on its server, so leaves are evaluated one at a time
+    mcts = MCTS(model, torch.device("cpu"), simulations, batch_size=1, cache=cache) if simulations else None
+
+    while tasks.get() is not None:
+        board = create_board(backend)
+        play_data = []
+        if mcts: mcts.reset()
+
+        while not board.is_game_over():
+            state = torch.from_numpy(board.planes.copy()).unsqueeze(0)
+            if mcts:
+                mcts.search(board)
+                indices, probabilities = mcts.policy_target()
+                move_index = mcts.best_move(1.0 if sample else 0.0)
+            else:
+                evaluation = cached_probabilities(cache, board) if cache else None
+                if evaluation is None:
+                    output = model(state)
+                    evaluation = legal_softmax(output["policy"][0], board)
+                    if cache: cache_evaluation(cache, board, *evaluation, output["value"].item())
+                indices, probabilities = evaluation
+                if sample:
+                    move_index = indices[torch.multinomial(probabilities, num_samples=1)].item()
+                else:
+                    move_index = indices[torch.argmax(probabilities)].item()
+
+            play_data.append({
+                "player": board.turn,
+                "state": state,
+                "policy_index": indices,
+                "policy_prob": probabilities
+            })
+            board.push(move_index)
+            if mcts: mcts.advance(move_index)
+
+        assign_values(play_data, get_winner(board))
+        writer.add_game(play_data)
+        results.put(board.result)
+
+    writer.close()
+    requests.put(None)
@@ -0,0 +1,167 @@
+import os
+import queue
+import threading
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+from ai.shards import Shard, PACKED_PLANES, MAX_POLICY_MOVES, list_shards
+
+class ReplayBuffer():
+    # Fixed-capacity ring of training samples kept in the shard layout (packed planes, padded sparse policy).
+    # update() only reads shards it hasn't seen, the oldest samples are overwritten once the buffer is full.
+
+    def __init__(self, capacity=200_000, recency_half_life=None):
+        self.capacity = capacity
+        self.recency_half_life = recency_half_life # In samples, None samples uniformly
+
+        self.planes = torch.zeros((capacity, PACKED_PLANES), dtype=torch.uint8)
+        self.policy_index = torch.zeros((capacity, MAX_POLICY_MOVES), dtype=torch.int16)
+        self.policy_prob = torch.zeros((capacity, MAX_POLICY_MOVES), dtype=torch.float16)
+        self.values = torch.zeros(capacity, dtype=torch.int8)
+        self.steps = torch.zeros(capacity, dtype=torch.int64) # Write counter of each slot, for recency weighting
+
+        self.size = 0
+        self.written = 0
+        self.ingested = set()
+
+    def __len__(self):
+        return self.size
+
+    def update(self, data_dir="data"):
+        # Adds the shards written since the last call, oldest first, returns the number of new samples
+        paths = list_shards(data_dir)
+        new = [path for path in reversed(paths) if os.path.basename(path) not in self.ingested]
+        added = 0
+        for path in new:
+            try:
+                shard = Shard(path)
+            except FileNotFoundError:
+                continue # Removed by self-play cleanup before we got to it
+            added += self.add_shard(shard)
+            self.ingested.add(os.path.basename(path))
+
+        # Forget names that cleanup removed so the set stays as small as the directory
+        self.ingested.intersection_update(os.path.basename(path) for path in paths)
+        return added
+
+    def add_shard(self, shard):
+        count = len(shard)
+        if count == 0:
+            return 0
+        first = max(count - self.capacity, 0) # More than fits, keep the newest
+        count -= first
+
+        # Sparse policy offsets to a padded (count, MAX_POLICY_MOVES) layout in one scatter
+        offsets = shard.policy_offsets[first:].astype(np.int64)
+        lengths = np.diff(offsets)
+        rows = np.repeat(np.arange(count), lengths)
+        cols = np.arange(offsets[-1] - offsets[0]) - np.repeat(offsets[:-1] - offsets[0], lengths)
+        index = np.zeros((count, MAX_POLICY_MOVES), dtype=np.int16)
+        prob = np.zeros((count, MAX_POLICY_MOVES), dtype=np.float16)
+        index[rows, cols] = shard.policy_index[offsets[0]:offsets[-1]]
+        prob[rows, cols] = shard.policy_prob[offsets[0]:offsets[-1]]
+
+        slots = (self.written + torch.arange(count)) % self.capacity
+        self.planes[slots] = torch.from_numpy(np.array(shard.planes[first:]))
+        self.policy_index[slots] = torch.from_numpy(index)
+        self.policy_prob[slots] = torch.from_numpy(prob)
+        self.values[slots] = torch.from_numpy(np.array(shard.values[first:]))
+        self.steps[slots] = self.written + torch.arange(count)
+
+        self.written += count
+        self.size = min(self.size + count, self.capacity)
+        return count
+
+    def sample_indices(self, batch_size):
+        if self.recency_half_life is None:
+            return torch.randint(self.size, (batch_size,))
+        age = (self.written - 1 - self.steps[:self.size]).double()
+        weights = torch.pow(0.5, age / self.recency_half_life)
+        return torch.multinomial(weights, batch_size, replacement=True)
+
+    def gather(self, indices):
+        # (states float32 (N, 18, 8, 8), policy index int64 and prob float32 (N, MAX_POLICY_MOVES), values float32 (N, 1)).
+        # Policies stay sparse, padding has index 0 and probability 0.
+        states = np.unpackbits(self.planes[indices].numpy(), axis=1).reshape(-1, 18, 8, 8)
+        policy_index = self.policy_index[indices].long()
+        policy_prob = self.policy_prob[indices].float()
+        values = self.values[indices].float().unsqueeze(1)
+        return torch.from_numpy(states.astype(np.float32)), policy_index, policy_prob, values
+
+    def sample(self, batch_size):
+        return self.gather(self.sample_indices(batch_size))
+
+    def batches(self, batch_size=32, num_batches=None):
+        for indices in ReplaySampler(self, batch_size, num_batches):
+            yield self.gather(indices)
+
+
+class ReplayDataset(Dataset):
+    # Indexed by a whole tensor of sample indices, use with DataLoader(batch_size=None, sampler=ReplaySampler(...))
+
+    def __init__(self, buffer: ReplayBuffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, indices):
+        return self.buffer.gather(indices)
+
+
+class ReplaySampler(Sampler):
+    # Yields index tensors, one per minibatch. About one pass over the buffer by default, a shuffled
+    # pass without repeats for uniform sampling, recency-weighted draws otherwise.
+    # drop_last keeps every batch full, compiled models would otherwise recompile for the odd size.
+
+    def __init__(self, buffer: ReplayBuffer, batch_size=32, num_batches=None, drop_last=False):
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+        self.drop_last = drop_last
+
+    def __len__(self):
+        if self.num_batches:
+            return self.num_batches
+        if self.drop_last:
+            return len(self.buffer) // self.batch_size
+        return -(-len(self.buffer) // self.batch_size)
+
+    def __iter__(self):
+        if self.buffer.recency_half_life is not None:
+            for _ in range(len(self)):
+                yield self.buffer.sample_indices(self.batch_size)
+            return
+
+        permutation = torch.randperm(len(self.buffer))
+        start = 0
+        for _ in range(len(self)):
+            if start >= len(permutation) or (self.drop_last and start + self.batch_size > len(permutation)):
+                permutation = torch.randperm(len(self.buffer))
+                start = 0
+            yield permutation[start:start + self.batch_size]
+            start += self.batch_size
+
+
+def prefetch(batches, depth=2):
+    # Builds the next batches on a background thread while the caller trains on the current one
+    ready = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for batch in batches:
+                ready.put(batch)
+        except Exception as error:
+            ready.put(error)
+        ready.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        batch = ready.get()
+        if batch is done:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
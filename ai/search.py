@@ -0,0 +1,282 @@
+import time
+import numpy as np
+import torch
+
+from ai.model import GoldfishModel
+from ai.utils import move_priors
+
+MATE = 1000.0 # Network values are in [-1, 1], mates score far outside them
+MATE_BOUND = MATE - 500
+EXACT, LOWER, UPPER = 0, 1, 2
+QUIESCENCE_DEPTH = 6
+PIECE_VALUES = {"pawn": 1, "knight": 3, "bishop": 3, "rook": 5, "queen": 9, "king": 0}
+
+class SearchStopped(Exception):
+    pass
+
+
+class AlphaBetaSearch():
+    # Iterative-deepening negamax over a ChessBoard using push/pop. The policy head orders moves and the
+    # value head scores leaves, each position goes through the network once per search.
+    # search() always returns a move once the time or node budget runs out, from the deepest finished iteration.
+
+    def __init__(self, model: GoldfishModel, device: torch.device, time_limit=1.0, max_nodes=None, max_depth=32,
+                 tt_size=1 << 18, cache=None):
+        self.model = model
+        self.device = device
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.tt_size = tt_size
+        self.cache = cache # Optional ai.cache.EvalCache
+
+        self.table = [None] * tt_size # (key, depth, score, bound, move), always replaced
+        self.history = np.zeros(4096, dtype=np.float64)
+        self.evaluations = {}
+        self.stopped = False
+        self.nodes = 0
+        self.depth = 0
+
+    def stop(self):
+        # Safe to call from another thread, the running search returns its best move so far
+        self.stopped = True
+
+    def search(self, board, time_limit=None, max_nodes=None, on_iteration=None):
+        # on_iteration(depth, score, nodes, seconds, principal variation) runs after every finished depth.
+        # A stop() that arrives before the search starts still ends it, the flag is cleared on the way out
+        try:
+            return self._search(board, time_limit, max_nodes, on_iteration)
+        finally:
+            self.stopped = False
+
+    def _search(self, board, time_limit, max_nodes, on_iteration):
+        start = time.perf_counter()
+        time_limit = time_limit if time_limit is not None else self.time_limit
+        max_nodes = max_nodes if max_nodes is not None else self.max_nodes
+        self.deadline = time.perf_counter() + time_limit if time_limit else None
+        self.node_limit = max_nodes
+        self.nodes = 0
+        self.depth = 0
+        self.killers = [[None, None] for _ in range(self.max_depth + QUIESCENCE_DEPTH + 1)]
+        self.history *= 0.5 # Age instead of forgetting, the previous move's search is still relevant
+        self.evaluations.clear()
+
+        moves = board.legal_moves()
+        if not moves:
+            return None
+        priors, _ = self._evaluate(board)
+        best_move = max(moves, key=lambda move: priors.get(move, 0.0))
+        self.score = 0.0
+
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score, move = self._root(board, depth, best_move)
+            except SearchStopped:
+                break
+            best_move, self.score, self.depth = move, score, depth
+            if on_iteration:
+                on_iteration(depth, score, self.nodes, time.perf_counter() - start, self.principal_variation(board, depth))
+            if abs(score) >= MATE_BOUND:
+                break # Forced mate found, deeper iterations can't change the result
+
+        return best_move
+
+    def principal_variation(self, board, max_length):
+        # Best line from the transposition table, stops at the first missing or stale entry
+        line, seen = [], set()
+        try:
+            while len(line) < max_length:
+                entry = self.table[board.hash % self.tt_size]
+                if entry is None or entry[0] != board.hash or board.hash in seen or entry[4] not in board.legal_moves():
+                    break
+                seen.add(board.hash)
+                board.push(entry[4])
+                line.append(entry[4])
+        finally:
+            for _ in line:
+                board.pop()
+        return line
+
+    def _root(self, board, depth, previous_best):
+        alpha, beta = -MATE - 1, MATE + 1
+        best_move, best_score = previous_best, -MATE - 1
+        for move in self._order(board, board.legal_moves(), previous_best, 0):
+            board.push(move)
+            try:
+                score = -self._negamax(board, depth - 1, -beta, -alpha, 1)
+            finally:
+                board.pop()
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+
+        self._store(board.hash, depth, best_score, EXACT, best_move, 0)
+        return best_score, best_move
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        self._count_node()
+
+        if board.halfmove_clock >= 100 or board.is_repetition(2):
+            return 0.0
+
+        moves = board.legal_moves()
+        if not moves:
+            return -MATE + ply if board.is_in_check(board.turn) else 0.0
+        if depth <= 0:
+            return self._quiescence(board, alpha, beta, ply, 0)
+
+        original_alpha = alpha
+        entry = self.table[board.hash % self.tt_size]
+        tt_move = None
+        if entry is not None and entry[0] == board.hash:
+            _, tt_depth, tt_score, bound, tt_move = entry
+            tt_score = _score_from_table(tt_score, ply)
+            if tt_depth >= depth:
+                if bound == EXACT:
+                    return tt_score
+                if bound == LOWER:
+                    alpha = max(alpha, tt_score)
+                elif bound == UPPER:
+                    beta = min(beta, tt_score)
+                if alpha >= beta:
+                    return tt_score
+
+        best_score, best_move = -MATE - 1, None
+        for move in self._order(board, moves, tt_move, ply):
+            quiet = not self._is_capture(board, move)
+            board.push(move)
+            try:
+                score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                board.pop()
+
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if quiet:
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1], killers[0] = killers[0], move
+                    self.history[move & 4095] += depth * depth
+                break
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self._store(board.hash, depth, best_score, bound, best_move, ply)
+        return best_score
+
+    def _quiescence(self, board, alpha, beta, ply, depth):
+        # Only captures and promotions past the horizon, in check every evasion is searched
+        in_check = board.is_in_check(board.turn)
+        moves = board.legal_moves()
+        if not moves:
+            return -MATE + ply if in_check else 0.0
+
+        if in_check and depth < QUIESCENCE_DEPTH:
+            best_score = -MATE - 1
+        else:
+            best_score = self._evaluate(board)[1]
+            if best_score >= beta or depth >= QUIESCENCE_DEPTH:
+                return best_score
+            alpha = max(alpha, best_score)
+            moves = sorted((move for move in moves if self._is_capture(board, move)),
+                           key=lambda move: self._mvv_lva(board, move), reverse=True)
+
+        for move in moves:
+            self._count_node()
+            board.push(move)
+            try:
+                score = -self._quiescence(board, -beta, -alpha, ply + 1, depth + 1)
+            finally:
+                board.pop()
+            if score > best_score:
+                best_score = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        return best_score
+
+    def _order(self, board, moves, tt_move, ply):
+        priors, _ = self._evaluate(board)
+        killers = self.killers[ply]
+
+        def score(move):
+            if move == tt_move:
+                return 4.0
+            if move in killers:
+                return 3.0
+            return priors.get(move, 0.0) + min(self.history[move & 4095] / 1000, 1.0)
+        return sorted(moves, key=score, reverse=True)
+
+    def _evaluate(self, board):
+        # Returns ({move: prior}, value) for the side to move
+        key = board.hash
+        evaluation = self.evaluations.get(key)
+        if evaluation is not None:
+            return evaluation
+
+        moves = board.legal_moves()
+        entry = self.cache.get(key, moves) if self.cache is not None else None
+        if entry is not None:
+            cached_moves, priors, value = entry
+            evaluation = (dict(zip(cached_moves, priors.tolist())), value)
+        else:
+            state = torch.from_numpy(board.planes).unsqueeze(0).to(self.device)
+            with torch.no_grad():
+                output = self.model(state)
+            value = output["value"].item()
+            priors = move_priors(output["policy"][0].cpu(), moves)
+            evaluation = (dict(zip(moves, priors.tolist())), value)
+            if self.cache is not None:
+                self.cache.put(key, moves, priors.numpy(), value)
+
+        self.evaluations[key] = evaluation
+        return evaluation
+
+    def _count_node(self):
+        self.nodes += 1
+        if self.stopped:
+            raise SearchStopped
+        if self.node_limit and self.nodes >= self.node_limit:
+            raise SearchStopped
+        if self.deadline and (self.nodes & 15) == 0 and time.perf_counter() >= self.deadline:
+            raise SearchStopped
+
+    def _store(self, key, depth, score, bound, move, ply):
+        self.table[key % self.tt_size] = (key, depth, _score_to_table(score, ply), bound, move)
+
+    def _is_capture(self, board, move):
+        to_sq, from_sq = move & 63, (move >> 6) & 63
+        if board.board[to_sq // 8][to_sq % 8]:
+            return True
+        piece = board.board[from_sq // 8][from_sq % 8]
+        # En passant and promotions change the material balance too
+        return piece.endswith("pawn") and (to_sq % 8 != from_sq % 8 or to_sq // 8 in (0, 7))
+
+    def _mvv_lva(self, board, move):
+        to_sq, from_sq = move & 63, (move >> 6) & 63
+        victim = board.board[to_sq // 8][to_sq % 8]
+        attacker = board.board[from_sq // 8][from_sq % 8]
+        return 10 * (PIECE_VALUES[victim[2:]] if victim else 1) - PIECE_VALUES[attacker[2:]]
+
+def _score_to_table(score, ply):
+    # Mate scores are stored relative to the node so they stay valid at other plies
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def _score_from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
@@ -0,0 +1,122 @@
+import torch
+
+from game.board import create_board
+from game.state import encode_batch
+from ai.model import GoldfishModel
+from ai.mcts import MCTS
+from ai.shards import ShardWriter
+from ai.utils import *
+from tools.instrument import timer, count
+
+class BatchedSelfPlay():
+    # Plays many games in lockstep, every ply evaluates all live positions in one forward pass.
+    # With a simulation budget moves and policy targets come from MCTS visit counts instead, one game at a time
+    # (each search batches its own leaves).
+
+    def __init__(self, device: torch.device, model: GoldfishModel = None, batch_size=32, backend="bitboard",
+                 sample=False, data_dir="data", max_games=1000, debug=False, simulations=0):
+        self.device = device
+        self.model = model or GoldfishModel().to(self.device)
+        self.batch_size = batch_size
+        self.backend = backend
+        self.sample = sample
+        self.data_dir = data_dir
+        self.max_games = max_games
+        self.debug = debug
+        self.simulations = simulations
+
+        self.states = allocate_state_buffer(batch_size, pin_memory=device.type == "cuda")
+
+    def play(self, num_games):
+        if self.simulations:
+            return self._play_searched(num_games)
+
+        games = []
+        started = finished = 0
+        results = []
+        writer = ShardWriter(self.data_dir, max_games=self.max_games)
+
+        while finished < num_games:
+            # Keep the batch full while there are games left to start
+            while len(games) < self.batch_size and started < num_games:
+                games.append((create_board(self.backend), []))
+                started += 1
+
+            boards = [board for board, _ in games]
+            batch = len(boards)
+            states = encode_batch(boards, out=self.states[:batch])
+
+            with torch.no_grad():
+                output = self.model(states.to(self.device, non_blocking=True))
+
+            with timer("selfplay.policy"):
+                # Only the legal logits of each position, padded to the longest move list
+                indices, probabilities = batched_legal_softmax(output["policy"], boards)
+
+                if self.sample:
+                    choices = torch.multinomial(probabilities, num_samples=1)
+                else:
+                    choices = torch.argmax(probabilities, dim=1, keepdim=True)
+                move_indices = indices.gather(1, choices).squeeze(1).tolist()
+                indices, probabilities = indices.cpu(), probabilities.cpu()
+            count("selfplay.positions", batch)
+
+            live = []
+            for i, (board, play_data) in enumerate(games):
+                play_data.append({
+                    "player": board.turn,
+                    "state": states[i:i + 1].clone(),
+                    "policy_index": indices[i].clone(), # Padding has probability 0, the shard writer drops it
+                    "policy_prob": probabilities[i].clone()
+                })
+                board.push(move_indices[i])
+
+                if board.is_game_over():
+                    results.append(self._finish_game(board, play_data, writer))
+                    finished += 1
+                else:
+                    live.append((board, play_data))
+            games = live
+
+        filename = writer.close()
+        if self.debug: print(f"Saved {num_games} games to {filename}")
+        return results
+
+    def _play_searched(self, num_games):
+        results = []
+        writer = ShardWriter(self.data_dir, max_games=self.max_games)
+        mcts = MCTS(self.model, self.device, self.simulations)
+        temperature = 1.0 if self.sample else 0.0
+
+        for _ in range(num_games):
+            board = create_board(self.backend)
+            play_data = []
+            mcts.reset()
+            while not board.is_game_over():
+                mcts.search(board)
+                indices, probabilities = mcts.policy_target()
+                move = mcts.best_move(temperature)
+                count("selfplay.positions")
+
+                play_data.append({
+                    "player": board.turn,
+                    "state": torch.from_numpy(board.planes.copy()).unsqueeze(0),
+                    "policy_index": indices,
+                    "policy_prob": probabilities
+                })
+                board.push(move)
+                mcts.advance(move)
+            results.append(self._finish_game(board, play_data, writer))
+
+        filename = writer.close()
+        if self.debug: print(f"Saved {num_games} games to {filename}")
+        return results
+
+    def _finish_game(self, board, play_data, writer):
+        count("selfplay.games")
+        winner = get_winner(board)
+        assign_values(play_data, winner)
+        writer.add_game(play_data)
+
+        if self.debug: print(f"Game result: {board.result}, Winner: {winner}, {len(play_data)} samples")
+        return board.result
@@ -0,0 +1,237 @@
+import argparse
+import os
+import struct
+import time
+import uuid
+import numpy as np
+import torch
+
+# Shard file layout, little-endian, every section starts on an 8 byte boundary:
+#   header          magic, version, games, samples, policy entries
+#   game offsets    uint32[games + 1], first sample of each game
+#   planes          uint8[samples, 144], the 18x8x8 binary planes bit-packed
+#   values          int8[samples]
+#   policy offsets  uint32[samples + 1], first policy entry of each sample
+#   policy index    uint16[entries], move index of each nonzero policy probability
+#   policy prob     float16[entries]
+SHARD_MAGIC = b"GFSH"
+SHARD_VERSION = 1
+SHARD_SUFFIX = ".gfs"
+HEADER = struct.Struct("<4sHHIII")
+PACKED_PLANES = 18 * 8 * 8 // 8
+MAX_POLICY_MOVES = 218 # Most legal moves any chess position has, so a policy never has more nonzero entries
+
+def _numpy(array):
+    return array.detach().cpu().numpy() if isinstance(array, torch.Tensor) else np.asarray(array)
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+def _sections(games, samples, entries):
+    # (name, dtype, shape) in file order with their byte offsets
+    layout = [
+        ("game_offsets", np.uint32, (games + 1,)),
+        ("planes", np.uint8, (samples, PACKED_PLANES)),
+        ("values", np.int8, (samples,)),
+        ("policy_offsets", np.uint32, (samples + 1,)),
+        ("policy_index", np.uint16, (entries,)),
+        ("policy_prob", np.float16, (entries,)),
+    ]
+    offset = _align(HEADER.size)
+    sections = []
+    for name, dtype, shape in layout:
+        sections.append((name, dtype, shape, offset))
+        offset = _align(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return sections, offset
+
+def read_header(path):
+    with open(path, "rb") as file:
+        magic, version, _, games, samples, entries = HEADER.unpack(file.read(HEADER.size))
+    if magic != SHARD_MAGIC or version != SHARD_VERSION:
+        raise ValueError(f"Not a version {SHARD_VERSION} shard: {path}")
+    return games, samples, entries
+
+
+class Shard():
+    # Read-only view of a shard file, samples are decoded straight from the memory map
+
+    def __init__(self, path):
+        self.path = path
+        self.num_games, self.num_samples, self.num_entries = read_header(path)
+        self._open()
+
+    def _open(self):
+        data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        sections, _ = _sections(self.num_games, self.num_samples, self.num_entries)
+        for name, dtype, shape, offset in sections:
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            setattr(self, name, data[offset:offset + size].view(dtype).reshape(shape))
+
+    def __getstate__(self):
+        # Reopen the map in DataLoader workers instead of pickling its contents
+        return {"path": self.path, "num_games": self.num_games, "num_samples": self.num_samples,
+                "num_entries": self.num_entries}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return self.num_samples
+
+    def sample(self, index):
+        # (planes float32 (18, 8, 8), policy float32 (4096,), value float)
+        planes = np.unpackbits(self.planes[index]).reshape(18, 8, 8).astype(np.float32)
+        start, end = self.policy_offsets[index], self.policy_offsets[index + 1]
+        policy = np.zeros(4096, dtype=np.float32)
+        policy[self.policy_index[start:end]] = self.policy_prob[start:end]
+        return planes, policy, float(self.values[index])
+
+
+class ShardWriter():
+    # Collects finished games and writes them as one shard per flush. Files appear atomically,
+    # a reader never sees a partially written shard.
+
+    def __init__(self, data_dir="data", max_samples=16384, max_games=1000):
+        self.data_dir = data_dir
+        self.max_samples = max_samples
+        self.max_games = max_games
+        self._clear()
+
+    def _clear(self):
+        self.game_lengths = []
+        self.planes, self.values, self.policy_index, self.policy_prob = [], [], [], []
+
+    def add_game(self, play_data):
+        # Samples hold a sparse policy ("policy_index", "policy_prob") or a dense 4096 "policy"
+        for data in play_data:
+            state = data["state"]
+            state = state.numpy() if isinstance(state, torch.Tensor) else np.asarray(state)
+            if "policy_index" in data:
+                indices, probabilities = _numpy(data["policy_index"]), _numpy(data["policy_prob"]).astype(np.float32)
+                nonzero = probabilities != 0
+                indices, probabilities = indices[nonzero], probabilities[nonzero]
+            else:
+                policy = _numpy(data["policy"]).astype(np.float32)
+                indices = np.flatnonzero(policy)
+                probabilities = policy[indices]
+
+            self.planes.append(np.packbits(state.reshape(-1) != 0))
+            self.values.append(data["value"])
+            self.policy_index.append(indices.astype(np.uint16))
+            self.policy_prob.append(probabilities.astype(np.float16))
+        self.game_lengths.append(len(play_data))
+
+        if len(self.values) >= self.max_samples:
+            return self.flush()
+        return None
+
+    def flush(self):
+        # Writes the buffered games as a new shard, returns its filename or None if there was nothing to write
+        if not self.values:
+            return None
+
+        games, samples = len(self.game_lengths), len(self.values)
+        policy_offsets = np.zeros(samples + 1, dtype=np.uint32)
+        np.cumsum([len(indices) for indices in self.policy_index], out=policy_offsets[1:])
+        game_offsets = np.zeros(games + 1, dtype=np.uint32)
+        np.cumsum(self.game_lengths, out=game_offsets[1:])
+        entries = int(policy_offsets[-1])
+
+        columns = {
+            "game_offsets": game_offsets,
+            "planes": np.stack(self.planes),
+            "values": np.array(self.values, dtype=np.int8),
+            "policy_offsets": policy_offsets,
+            "policy_index": np.concatenate(self.policy_index) if entries else np.zeros(0, dtype=np.uint16),
+            "policy_prob": np.concatenate(self.policy_prob) if entries else np.zeros(0, dtype=np.float16),
+        }
+        sections, size = _sections(games, samples, entries)
+        buffer = bytearray(size)
+        HEADER.pack_into(buffer, 0, SHARD_MAGIC, SHARD_VERSION, 0, games, samples, entries)
+        for name, dtype, shape, offset in sections:
+            raw = np.ascontiguousarray(columns[name], dtype=dtype).tobytes()
+            buffer[offset:offset + len(raw)] = raw
+
+        # Names sort oldest first, the temporary file is renamed into place once complete
+        os.makedirs(self.data_dir, exist_ok=True)
+        filename = os.path.join(self.data_dir, f"shard_{time.time_ns()}_{uuid.uuid4().hex[:8]}{SHARD_SUFFIX}")
+        with open(filename + ".tmp", "wb") as file:
+            file.write(buffer)
+        os.replace(filename + ".tmp", filename)
+
+        self._clear()
+        cleanup_shards(self.data_dir, self.max_games)
+        return filename
+
+    def close(self):
+        return self.flush()
+
+
+def list_shards(data_dir="data"):
+    # Newest first
+    if not os.path.isdir(data_dir):
+        return []
+    names = sorted((f for f in os.listdir(data_dir) if f.endswith(SHARD_SUFFIX)), reverse=True)
+    return [os.path.join(data_dir, name) for name in names]
+
+def load_shards(data_dir="data", max_games=50):
+    # Newest shards until they hold at least max_games games
+    shards, games = [], 0
+    for path in list_shards(data_dir):
+        if games >= max_games:
+            break
+        try:
+            shard = Shard(path)
+        except FileNotFoundError:
+            continue # Removed by a cleanup in another process
+        shards.append(shard)
+        games += shard.num_games
+    return shards
+
+def cleanup_shards(data_dir="data", max_games=1000):
+    # Keeps the newest shards holding max_games games, a shard that crosses the limit is kept whole
+    games = 0
+    for path in list_shards(data_dir):
+        if games >= max_games:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass # Another self-play process got there first
+            continue
+        try:
+            games += read_header(path)[0]
+        except (FileNotFoundError, ValueError):
+            pass
+
+def convert_pt_files(data_dir="data", remove=True, max_samples=16384):
+    # Rewrites the old per-game torch.save files as shards, oldest first
+    files = sorted((f for f in os.listdir(data_dir) if f.endswith(".pt")),
+                   key=lambda name: os.path.getmtime(os.path.join(data_dir, name)))
+    writer = ShardWriter(data_dir, max_samples=max_samples, max_games=len(files) + 1_000_000)
+    converted = []
+    for name in files:
+        path = os.path.join(data_dir, name)
+        writer.add_game(torch.load(path))
+        converted.append(path)
+        if not writer.values:
+            # Shard written, the files it holds can go
+            if remove:
+                for done in converted:
+                    os.remove(done)
+            converted = []
+    writer.close()
+    if remove:
+        for done in converted:
+            os.remove(done)
+    return len(files)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="app.py convert-data", description="Convert data/*.pt game files to shards")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--keep", action="store_true", help="keep the .pt files after converting")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = convert_pt_files(args.data_dir, remove=not args.keep)
+    print(f"Converted {count} games in {time.perf_counter() - start:.2f}s")
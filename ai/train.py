@@ -1,120 +1,182 @@
+import argparse
 import os
 import csv
+import time
 import torch
 import torch.nn.functional as F
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import DataLoader
 
 from ai.model import GoldfishModel
-from ai.engine import Engine
+from ai.selfplay import BatchedSelfPlay
+from ai.pool import SelfPlayPool
+from ai.replay import ReplayBuffer, ReplayDataset, ReplaySampler, prefetch
+from ai.checkpoints import CheckpointRegistry, resume
+import tools.instrument as instrument
 
-def main():
+def main(epoch=10, games_per_epoch=10, self_play_workers=0, workers_per_server=8, cache_mb=64,
+         replay_capacity=200_000, recency_half_life=None, batch_size=32, prefetch_batches=2, fast=False,
+         keep_checkpoints=5, simulations=0, reuse=5.0):
 
     # Device setup
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    epoch = 10
-    games_per_epoch = 10
+    # Load model and optimizer from the newest checkpoint
+    model = GoldfishModel().to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    checkpoints = CheckpointRegistry(keep_last=keep_checkpoints)
+    generation = resume(checkpoints, model, optimizer, device)
+    if generation is not None:
+        print(f"Loaded existing model (generation {generation}).")
+
+    # Self-play runs every game of an epoch in lockstep with the current model, or across worker processes.
+    # With simulations moves and policy targets come from MCTS visit counts.
+    if self_play_workers:
+        self_play = SelfPlayPool(model, num_workers=self_play_workers, workers_per_server=workers_per_server, device=device,
+                                 cache_mb=cache_mb, simulations=simulations)
+    else:
+        self_play = BatchedSelfPlay(device, model, batch_size=games_per_epoch, simulations=simulations)
+
+    # Fast mode trains a compiled channels_last copy under autocast, self-play keeps using the eager model
+    if fast:
+        train_model, scaler = prepare_fast_training(model, device)
+
+    # Samples stay in memory between epochs, each epoch only reads the new shards
+    replay = ReplayBuffer(replay_capacity, recency_half_life)
 
     # Train N epochs (100 for now) and save to file
     for epoch in range (epoch):
 
         # Genereate training data with self-play
-        for _ in range(games_per_epoch):
-            Engine(device)
-
-        # Load data
-        data = load_training_data()
-        dataset = TrainingDataset(data)
-        loader = DataLoader(dataset, batch_size=32, shuffle=True, pin_memory=True)
-
-        # Load model
-        if epoch == 0:
-            model = GoldfishModel().to(device)
-            if os.path.exists("model/goldfish_model.pt"):
-                model.load_state_dict(torch.load("model/goldfish_model.pt", map_location=device))
-                print("Loaded existing model.")
-
-            # Optimizer
-            optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
-
-        
-        os.makedirs("model", exist_ok=True)
-        
-        train_one_epoch(model, loader, optimizer, device, epoch)
-        torch.save(model.state_dict(), "model/goldfish_model.pt")
-        # print("Model saved to model/goldfish_model.pt")
-
-
-def load_training_data(data_dir="data", max_files=50):
-    all_files = sorted(
-        [f for f in os.listdir(data_dir) if f.endswith(".pt")],
-        key=lambda x: os.path.getmtime(os.path.join(data_dir, x)),
-        reverse=True
-    )[:max_files]
-
-    all_data = []
-    for filename in all_files:
-        if filename.endswith(".pt"):
-            filepath = os.path.join(data_dir, filename)
-            game_data = torch.load(filepath)
-            all_data.extend(game_data)
-
-    # print(f"Loaded {len(all_data)} training samples from {data_dir}")
-    return all_data
-
-class TrainingDataset(Dataset):
-    def __init__(self, data_list):
-        self.data = data_list
-
-    def __len__(self):
-        return len(self.data)
-    
-    def __getitem__(self, index):
-        sample = self.data[index]
-        state =  sample["state"].squeeze(0).float()
-        policy = sample["policy"].float()
-        value = torch.tensor([sample["value"]]).float()
-
-        return state, policy, value
-
-def train_one_epoch(model: GoldfishModel, dataloader: DataLoader, optimizer: torch.optim.Adam, device: torch.device, epoch: int):
+        model.eval()
+        self_play.play(games_per_epoch)
+
+        # Load new data
+        new_samples = replay.update()
+
+        # Each new sample is trained on about reuse times over its life in the buffer, so an epoch costs the same
+        # however full the buffer is, and never more than one pass. The default matches the old window of 50 games
+        # with 10 new per epoch.
+        num_batches = max(-(-int(min(new_samples * reuse, len(replay))) // batch_size), 1)
+
+        # Whole minibatches come out of the buffer in one gather, the next ones are built during backward
+        loader = DataLoader(ReplayDataset(replay), sampler=ReplaySampler(replay, batch_size, num_batches, drop_last=fast),
+                            batch_size=None, pin_memory=device.type == "cuda")
+        if prefetch_batches:
+            loader = prefetch(loader, prefetch_batches)
+
+        if fast:
+            train_one_epoch_fast(train_model, loader, optimizer, device, epoch, scaler)
+        else:
+            train_one_epoch(model, loader, optimizer, device, epoch)
+
+        # Written in the background, also published to model/goldfish_model.pt
+        checkpoints.save(model, optimizer, {"epoch": epoch})
+        if instrument.ENABLED: instrument.export() # logs/profile.json and .csv, totals since the start
+
+    checkpoints.wait()
+
+
+def train_one_epoch(model: GoldfishModel, dataloader, optimizer: torch.optim.Adam, device: torch.device, epoch: int):
     model.train()
     total_policy_loss = 0.0
     total_value_loss = 0.0
     total_loss = 0.0
+    num_batches = 0
+    samples = 0
+    start = time.perf_counter()
 
-    for batch in dataloader:
-        states, target_policies, target_values = batch
+    for batch in instrument.timed_iter(dataloader, "train.batch_wait"):
+        states, policy_index, policy_prob, target_values = batch
         states = states.to(device)
-        target_policies = target_policies.to(device)
+        policy_index = policy_index.to(device)
+        policy_prob = policy_prob.to(device)
         target_values = target_values.to(device)
 
-        output = model(states)
-        pred_logits = output["policy"]
-        pred_values = output["value"]
+        with instrument.timer("train.step"):
+            output = model(states)
+            pred_logits = output["policy"]
+            pred_values = output["value"]
+
+            # Losses, the policy target is sparse so only its entries of log_probs are read
+            log_probs = F.log_softmax(pred_logits, dim=1)
+            policy_loss = -(policy_prob * log_probs.gather(1, policy_index)).sum(dim=1).mean()
+            total_policy_loss += policy_loss.item()
+
+            value_loss = F.mse_loss(pred_values, target_values)
+            total_value_loss += value_loss.item()
+
+            loss = policy_loss + value_loss
 
-        # Losses
-        log_probs = F.log_softmax(pred_logits, dim=1)
-        policy_loss = -(target_policies * log_probs).sum(dim=1).mean()
-        total_policy_loss += policy_loss.item()
+            # Backprop
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
 
-        value_loss = F.mse_loss(pred_values, target_values)
-        total_value_loss += value_loss.item()
+            total_loss += loss.item()
+        num_batches += 1
+        samples += len(states)
 
+    avg_policy_loss = total_policy_loss / num_batches if num_batches > 0 else 0.0
+    avg_value_loss = total_value_loss / num_batches if num_batches > 0 else 0.0
+    avg_loss = total_loss / num_batches if num_batches > 0 else 0.0
+    print(f"Average training loss: {avg_loss:.4f} ({samples / (time.perf_counter() - start):.0f} samples/s)")
+
+    log_epoch_losses(epoch, avg_loss, avg_policy_loss, avg_value_loss)
+
+def autocast_dtype(device: torch.device):
+    return torch.float16 if device.type == "cuda" else torch.bfloat16
+
+def prepare_fast_training(model: GoldfishModel, device: torch.device, compile=True):
+    # Returns the module to train and a GradScaler when autocasting to fp16, the weights stay shared with model
+    model.to(memory_format=torch.channels_last)
+    train_model = torch.compile(model) if compile else model
+    scaler = torch.amp.GradScaler("cuda") if autocast_dtype(device) == torch.float16 else None
+    return train_model, scaler
+
+def train_one_epoch_fast(model: GoldfishModel, dataloader, optimizer: torch.optim.Adam, device: torch.device, epoch: int,
+                         scaler=None):
+    # Same losses as train_one_epoch, accumulated on the device so the only sync is at the end of the epoch
+    model.train()
+    totals = torch.zeros(3, device=device)
+    num_batches = 0
+    samples = 0
+    start = time.perf_counter()
+
+    for states, policy_index, policy_prob, target_values in instrument.timed_iter(dataloader, "train.batch_wait"):
+        states = states.to(device, non_blocking=True).contiguous(memory_format=torch.channels_last)
+        policy_index = policy_index.to(device, non_blocking=True)
+        policy_prob = policy_prob.to(device, non_blocking=True)
+        target_values = target_values.to(device, non_blocking=True)
+
+        with torch.autocast(device.type, dtype=autocast_dtype(device)):
+            output = model(states)
+
+        # Losses in fp32
+        log_probs = F.log_softmax(output["policy"].float(), dim=1)
+        policy_loss = -(policy_prob * log_probs.gather(1, policy_index)).sum(dim=1).mean()
+        value_loss = F.mse_loss(output["value"].float(), target_values)
         loss = policy_loss + value_loss
 
         # Backprop
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        if scaler:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
 
-        total_loss += loss.item()
+        totals += torch.stack((loss.detach(), policy_loss.detach(), value_loss.detach()))
+        num_batches += 1
+        samples += len(states)
 
-    avg_policy_loss = total_policy_loss / len(dataloader) if len(dataloader) > 0 else 0.0
-    avg_value_loss = total_value_loss / len(dataloader) if len(dataloader) > 0 else 0.0
-    avg_loss = total_loss / len(dataloader) if len(dataloader) > 0 else 0.0
-    print(f"Average training loss: {avg_loss:.4f}")
+    avg_loss, avg_policy_loss, avg_value_loss = (totals / max(num_batches, 1)).tolist()
+    print(f"Average training loss: {avg_loss:.4f} ({samples / (time.perf_counter() - start):.0f} samples/s)")
 
+    log_epoch_losses(epoch, avg_loss, avg_policy_loss, avg_value_loss)
+
+def log_epoch_losses(epoch, avg_loss, avg_policy_loss, avg_value_loss):
     # Log to CSV
     os.makedirs("logs", exist_ok=True)
     log_file = "logs/training_loss.csv"
@@ -124,15 +186,51 @@ def train_one_epoch(model: GoldfishModel, dataloader: DataLoader, optimizer: tor
         writer = csv.writer(file)
         if write_header:
             writer.writerow([
-            epoch,
-            avg_loss,
-            avg_policy_loss,
-            avg_value_loss,
-            # avg_top1_acc,
-            # avg_value_output
+            "epoch",
+            "avg_loss",
+            "avg_policy_loss",
+            "avg_value_loss",
+            # "avg_top1_acc",
+            # "avg_value_output"
         ])
             
         writer.writerow([epoch,avg_loss,avg_policy_loss,avg_value_loss,
             # avg_top1_acc,
             # avg_value_output
-        ])
\ No newline at end of file
+        ])
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog="app.py train", description="Self-play and training loop")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--games", type=int, default=10, help="self-play games per epoch")
+    parser.add_argument("--workers", type=int, default=0, help="self-play processes, 0 plays in-process")
+    parser.add_argument("--workers-per-server", type=int, default=8)
+    parser.add_argument("--cache-mb", type=float, default=64, help="shared evaluation cache for worker self-play")
+    parser.add_argument("--replay-capacity", type=int, default=200_000)
+    parser.add_argument("--recency-half-life", type=float, default=None, help="in samples, default samples uniformly")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--reuse", type=float, default=5.0, help="samples trained per new sample each epoch")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches built ahead, 0 disables")
+    parser.add_argument("--fast", action="store_true", help="autocast, torch.compile and channels_last")
+    parser.add_argument("--keep-checkpoints", type=int, default=5, help="newest checkpoint generations to keep")
+    parser.add_argument("--simulations", type=int, default=0,
+                        help="MCTS simulations per self-play move, default 0 plays straight from the policy")
+    parser.add_argument("--pipeline", action="store_true", help="self-play in background processes while training")
+    parser.add_argument("--generators", type=int, default=1, help="pipeline self-play processes")
+    parser.add_argument("--chunks", type=int, default=100, help="pipeline training chunks, the weights are saved after each")
+    parser.add_argument("--batches-per-chunk", type=int, default=50)
+    parser.add_argument("--max-reuse", type=float, default=8.0, help="trainer waits above this samples trained/generated")
+    parser.add_argument("--min-reuse", type=float, default=1.0, help="generators pause below this ratio")
+    args = parser.parse_args(argv)
+
+    if args.pipeline:
+        from ai.pipeline import TrainingPipeline
+        TrainingPipeline(args.generators, args.games, args.batch_size, args.batches_per_chunk, args.max_reuse,
+                         args.min_reuse, replay_capacity=args.replay_capacity,
+                         recency_half_life=args.recency_half_life, keep_checkpoints=args.keep_checkpoints,
+                         simulations=args.simulations, fast=args.fast).run(args.chunks)
+        return
+
+    main(args.epochs, args.games, args.workers, args.workers_per_server, args.cache_mb, args.replay_capacity,
+         args.recency_half_life, args.batch_size, args.prefetch, args.fast, args.keep_checkpoints, args.simulations,
+         args.reuse)
@@ -1,33 +1,108 @@
-import os
+import numpy as np
+import torch
 from game.board import ChessBoard
+from ai.shards import ShardWriter
+from tools.instrument import timed
 
+@timed()
 def get_all_legal_moves_4096(chessboard: ChessBoard):
     legal_moves_4096 = [0.0] * 4096
-    for from_row in range(8):
-        for from_col in range(8):
-            piece = chessboard.board[from_row][from_col]
-            if piece and piece[0] == chessboard.turn:
-                for to_row, to_col in chessboard.get_legal_moves(from_row, from_col):
-                    index = from_row * 512 + from_col * 64 + to_row * 8 + to_col
-                    legal_moves_4096[index] = 1.0
+    for move in chessboard.legal_moves():
+        legal_moves_4096[move & 4095] = 1.0
     
     return legal_moves_4096
 
-def decoder(encoded_index: int):
-    from_row  = encoded_index // 512
-    from_col  = (encoded_index % 512) // 64
-    to_row    = (encoded_index % 64) // 8
-    to_col    = encoded_index % 8
+def legal_move_indices(chessboard: ChessBoard):
+    # Compact moves are already policy indices, see ChessBoard.legal_indices
+    return torch.from_numpy(chessboard.legal_indices())
 
-    return from_row, from_col, to_row, to_col
+def pad_indices(index_arrays):
+    # (N, K) int64 indices padded with 0 and the (N, K) bool mask of real entries, K the longest list
+    counts = np.array([len(indices) for indices in index_arrays])
+    width = max(int(counts.max(initial=0)), 1)
+    valid = np.arange(width) < counts[:, None]
+    padded = np.zeros((len(index_arrays), width), dtype=np.int64)
+    padded[valid] = np.concatenate(index_arrays) if len(index_arrays) else []
+    return torch.from_numpy(padded), torch.from_numpy(valid)
 
-def cleanup_data(dir="data", max_files=1000):
-    files = sorted([f for f in os.listdir(dir) if f.endswith(".pt")])
-    if len(files) <= max_files:
-        return
-    
-    files_to_delete = files[:len(files) - max_files]
-    for fname in files_to_delete:
-        path = os.path.join(dir, fname)
-        os.remove(path)
-        # print(f"Deleted old training file: {path}")
\ No newline at end of file
+@timed()
+def legal_softmax(logits: torch.Tensor, chessboard: ChessBoard):
+    # Softmax over the legal moves' logits only, returns (indices, probabilities) with one entry per legal index
+    indices = legal_move_indices(chessboard).to(logits.device)
+    return indices, torch.softmax(logits[indices], dim=0)
+
+@timed()
+def batched_legal_softmax(logits: torch.Tensor, boards):
+    # legal_softmax for (N, 4096) logits, returns padded (N, K) indices and probabilities, padding has probability 0
+    indices, valid = pad_indices([board.legal_indices() for board in boards])
+    indices, valid = indices.to(logits.device), valid.to(logits.device)
+    gathered = logits.gather(1, indices).masked_fill(~valid, float("-inf"))
+    return indices, torch.softmax(gathered, dim=1)
+
+def move_priors(logits: torch.Tensor, moves):
+    # Priors in moves order from one position's 4096 policy logits. The softmax runs over the distinct indices,
+    # otherwise the four pieces of a promotion would each get the whole index's probability
+    plain = [move for move in moves if move < 4096]
+    probabilities = torch.softmax(logits[plain].float(), dim=0)
+    if len(plain) == len(moves):
+        return probabilities
+    return split_promotions(moves, plain, probabilities)
+
+def split_promotions(moves, indices, probabilities: torch.Tensor):
+    # Per-move priors from per-index probabilities, a promotion's probability is shared evenly by its pieces
+    lookup = dict(zip(indices, probabilities.tolist()))
+    shares = {}
+    for move in moves:
+        shares[move & 4095] = shares.get(move & 4095, 0) + 1
+    return torch.tensor([lookup[move & 4095] / shares[move & 4095] for move in moves], dtype=torch.float32)
+
+def seed_worker():
+    # Start of every spawned self-play process: one torch thread, and fresh seeds since they all start from the same ones
+    torch.set_num_threads(1)
+    torch.seed()
+    np.random.seed()
+
+def get_winner(chessboard: ChessBoard):
+    result = chessboard.result
+
+    if result == "checkmate":
+        return "b" if chessboard.turn == "w" else "w"
+    elif result == "stalemate" or (result and result.startswith("draw")):
+        return None
+    raise ValueError("Unexpected game result format: " + str(result))
+
+def assign_values(play_data, winner):
+    for data in play_data:
+        if winner is None:
+            data["value"] = 0 # Draw
+        else:
+            data["value"] = 1 if data["player"] == winner else -1
+
+def write_game_file(play_data, dir="data", max_files=1000):
+    # One game as its own shard, max_files is the number of games kept in dir
+    writer = ShardWriter(dir, max_games=max_files)
+    writer.add_game(play_data)
+    return writer.close()
+
+def allocate_state_buffer(batch_size: int, pin_memory=False):
+    # Preallocated (N, 18, 8, 8) input buffer for game.state.encode_batch, pinned for faster host to GPU copies
+    pin_memory = pin_memory and torch.cuda.is_available()
+    return torch.empty((batch_size, 18, 8, 8), dtype=torch.float32, pin_memory=pin_memory)
+
+def cached_probabilities(cache, chessboard: ChessBoard):
+    # (indices, probabilities) like legal_softmax from an ai.cache.EvalCache entry, None on a miss
+    entry = cache.get(chessboard.hash, chessboard.legal_moves())
+    if entry is None:
+        return None
+    moves, priors, _ = entry
+    moves = np.array(moves, dtype=np.int64)
+    # A promotion's pieces share one index, their priors add back up to its probability
+    totals = np.bincount(moves & 4095, weights=priors, minlength=4096)
+    indices = moves[moves < 4096]
+    probabilities = torch.from_numpy(totals[indices].astype(np.float32))
+    return torch.from_numpy(indices), probabilities / probabilities.sum()
+
+def cache_evaluation(cache, chessboard: ChessBoard, indices: torch.Tensor, probabilities: torch.Tensor, value: float):
+    # Stores legal_softmax output as priors over the full legal move list, the same ones MCTS and search use
+    moves = chessboard.legal_moves()
+    cache.put(chessboard.hash, moves, split_promotions(moves, indices.tolist(), probabilities.float()).numpy(), value)
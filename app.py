@@ -1,18 +1,65 @@
 import sys
-from PyQt6.QtWidgets import QApplication, QMainWindow
-from PyQt6.QtGui import QIcon
-from ui.main_window import ChessMainWindow
-from ai.train import main as train_main
 
-def main():
+# Each command imports what it needs when it runs, so the GUI never waits on torch
 
-    if len(sys.argv) > 1 and sys.argv[1] == "train":
-        train_main()
-    else:
-        app = QApplication(sys.argv)
-        window = ChessMainWindow()
-        window.show()
-        sys.exit(app.exec())
+def run_gui(argv):
+    from PyQt6.QtWidgets import QApplication
+    from ui.main_window import ChessMainWindow
+
+    app = QApplication([sys.argv[0]] + argv)
+    window = ChessMainWindow()
+    window.show()
+    sys.exit(app.exec())
+
+def run_train(argv):
+    from ai.train import cli
+    cli(argv)
+
+def run_perft(argv):
+    from game.perft import main
+    main(argv)
+
+def run_convert_data(argv):
+    from ai.shards import main
+    main(argv)
+
+def run_export(argv):
+    from ai.export import main
+    main(argv)
+
+def run_importtime(argv):
+    from tools.importtime import main
+    main(argv)
+
+def run_profile(argv):
+    from tools.instrument import main
+    main(argv)
+
+def run_bench(argv):
+    from tools.bench import main
+    main(argv)
+
+COMMANDS = {
+    "gui": run_gui,
+    "train": run_train,
+    "perft": run_perft,
+    "convert-data": run_convert_data,
+    "export": run_export,
+    "importtime": run_importtime,
+    "profile": run_profile,
+    "bench": run_bench,
+}
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    # No command (or only Qt options) opens the GUI
+    if not argv or argv[0].startswith("-") and argv[0] not in ("-h", "--help"):
+        return run_gui(argv)
+    if argv[0] not in COMMANDS:
+        print(f"usage: app.py [{' | '.join(COMMANDS)}] [options]")
+        sys.exit(0 if argv[0] in ("-h", "--help") else 2)
+    COMMANDS[argv[0]](argv[1:])
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,336 @@
+from game.board import ChessBoard
+from tools.instrument import timed
+
+# Square index is row * 8 + col, bit i of a bitboard is square i (row 0 is black's back rank)
+MASK64 = 0xFFFFFFFFFFFFFFFF
+A_FILE = 0x0101010101010101
+B_FILE = 0x0202020202020202
+DIAG_C7_B2 = 0x0080402010080400
+
+COLOURS = ("w", "b")
+PIECE_TYPES = ("pawn", "knight", "bishop", "rook", "queen", "king")
+PIECES = tuple(f"{colour}_{piece_type}" for colour in COLOURS for piece_type in PIECE_TYPES)
+PIECE_NAMES = {colour: tuple(f"{colour}_{piece_type}" for piece_type in PIECE_TYPES) for colour in COLOURS}
+
+
+def square(row, col):
+    return row * 8 + col
+
+def iter_squares(bb):
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+def popcount(bb):
+    return bin(bb).count("1")
+
+
+def _leaper_table(deltas):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        bb = 0
+        for d_row, d_col in deltas:
+            r, c = row + d_row, col + d_col
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << square(r, c)
+        table.append(bb)
+    return table
+
+KNIGHT_ATTACKS = _leaper_table([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS   = _leaper_table([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+
+# Squares attacked by a pawn of the given colour standing on sq
+PAWN_ATTACKS = {
+    "w": _leaper_table([(-1, -1), (-1, 1)]),
+    "b": _leaper_table([(1, -1), (1, 1)]),
+}
+
+
+# Kindergarten sliding attacks: the occupancy of one line through sq is folded into 6 bits
+# by a multiply and shift, then looked up in a per-square table of 64 attack sets.
+def _ray(sq, occupied, d_row, d_col):
+    row, col = divmod(sq, 8)
+    bb = 0
+    r, c = row + d_row, col + d_col
+    while 0 <= r < 8 and 0 <= c < 8:
+        bb |= 1 << square(r, c)
+        if occupied & (1 << square(r, c)):
+            break
+        r += d_row
+        c += d_col
+    return bb
+
+def _line_mask(sq, d_row, d_col):
+    return _ray(sq, 0, d_row, d_col) | _ray(sq, 0, -d_row, -d_col)
+
+def _rank_index(sq, occupied):
+    return ((occupied & RANK_MASKS[sq]) * B_FILE & MASK64) >> 58
+
+def _file_index(sq, occupied):
+    return (((occupied & FILE_MASKS[sq]) >> (sq & 7)) * DIAG_C7_B2 & MASK64) >> 58
+
+def _diag_index(sq, occupied):
+    return ((occupied & DIAG_MASKS[sq]) * B_FILE & MASK64) >> 58
+
+def _anti_index(sq, occupied):
+    return ((occupied & ANTI_MASKS[sq]) * B_FILE & MASK64) >> 58
+
+def _line_table(masks, index, d_row, d_col):
+    table = []
+    for sq in range(64):
+        bits = list(iter_squares(masks[sq]))
+        attacks = [None] * 64
+        for subset in range(1 << len(bits)):
+            occupied = 0
+            for i, bit in enumerate(bits):
+                if subset >> i & 1:
+                    occupied |= 1 << bit
+            bb = _ray(sq, occupied, d_row, d_col) | _ray(sq, occupied, -d_row, -d_col)
+            i = index(sq, occupied)
+            assert attacks[i] is None or attacks[i] == bb, "kindergarten index collision"
+            attacks[i] = bb
+        table.append([bb or 0 for bb in attacks])
+    return table
+
+RANK_MASKS = [_line_mask(sq, 0, 1) for sq in range(64)]
+FILE_MASKS = [_line_mask(sq, 1, 0) for sq in range(64)]
+DIAG_MASKS = [_line_mask(sq, 1, 1) for sq in range(64)]
+ANTI_MASKS = [_line_mask(sq, 1, -1) for sq in range(64)]
+
+RANK_ATTACKS = _line_table(RANK_MASKS, _rank_index, 0, 1)
+FILE_ATTACKS = _line_table(FILE_MASKS, _file_index, 1, 0)
+DIAG_ATTACKS = _line_table(DIAG_MASKS, _diag_index, 1, 1)
+ANTI_ATTACKS = _line_table(ANTI_MASKS, _anti_index, 1, -1)
+
+def rook_attacks(sq, occupied):
+    return (RANK_ATTACKS[sq][((occupied & RANK_MASKS[sq]) * B_FILE & MASK64) >> 58]
+          | FILE_ATTACKS[sq][(((occupied & FILE_MASKS[sq]) >> (sq & 7)) * DIAG_C7_B2 & MASK64) >> 58])
+
+def bishop_attacks(sq, occupied):
+    return (DIAG_ATTACKS[sq][((occupied & DIAG_MASKS[sq]) * B_FILE & MASK64) >> 58]
+          | ANTI_ATTACKS[sq][((occupied & ANTI_MASKS[sq]) * B_FILE & MASK64) >> 58])
+
+def queen_attacks(sq, occupied):
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+def _between_and_line(a, b):
+    # Squares strictly between a and b, and the full line through both (0 if they are not aligned)
+    for masks in (RANK_MASKS, FILE_MASKS, DIAG_MASKS, ANTI_MASKS):
+        if masks[a] >> b & 1:
+            between = rook_attacks(a, 1 << b) & rook_attacks(b, 1 << a) if masks in (RANK_MASKS, FILE_MASKS) \
+                else bishop_attacks(a, 1 << b) & bishop_attacks(b, 1 << a)
+            return between & masks[a], masks[a] | (1 << a)
+    return 0, 0
+
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for _a in range(64):
+    for _b in range(64):
+        if _a != _b:
+            BETWEEN[_a][_b], LINE[_a][_b] = _between_and_line(_a, _b)
+
+
+class BitboardChessBoard(ChessBoard):
+    # Same public API as ChessBoard, the 8x8 board is kept in sync for the UI and get_piece
+
+    def reset_board(self):
+        super().reset_board()
+        self.sync_bitboards()
+
+    def load_fen(self, fen):
+        super().load_fen(fen)
+        self.sync_bitboards()
+
+    def sync_bitboards(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {"w": 0, "b": 0}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece:
+                    bit = 1 << square(row, col)
+                    self.bitboards[piece] |= bit
+                    self.occupancy[piece[0]] |= bit
+
+    def _set_piece(self, row, col, piece):
+        bit = 1 << square(row, col)
+        old = self.board[row][col]
+        if old:
+            self.bitboards[old] ^= bit
+            self.occupancy[old[0]] ^= bit
+        if piece:
+            self.bitboards[piece] |= bit
+            self.occupancy[piece[0]] |= bit
+        super()._set_piece(row, col, piece)
+
+    def attackers(self, sq, colour, occupied=None, exclude=0):
+        # Pieces of colour attacking sq, ignoring any piece on an exclude square
+        if occupied is None:
+            occupied = self.occupancy["w"] | self.occupancy["b"]
+        bb = self.bitboards
+        pawn, knight, bishop, rook, queen, king = PIECE_NAMES[colour]
+        queens = bb[queen]
+        found = ((PAWN_ATTACKS["b" if colour == "w" else "w"][sq] & bb[pawn])
+               | (KNIGHT_ATTACKS[sq] & bb[knight])
+               | (KING_ATTACKS[sq] & bb[king])
+               | (bishop_attacks(sq, occupied) & (bb[bishop] | queens))
+               | (rook_attacks(sq, occupied) & (bb[rook] | queens)))
+        return found & ~exclude
+
+    def is_in_check(self, colour):
+        king_sq = self.bitboards[f"{colour}_king"].bit_length() - 1
+        enemy = "b" if colour == "w" else "w"
+        return king_sq >= 0 and self.attackers(king_sq, enemy) != 0
+
+    def is_in_check_pos(self, colour, row, col):
+        enemy = "b" if colour == "w" else "w"
+        return self.attackers(square(row, col), enemy) != 0
+
+    def generate_piece_moves(self, row, col):
+        piece = self.get_piece(row, col)
+        if not piece:
+            return []
+        return [divmod(to_sq, 8) for to_sq in iter_squares(self._pseudo_targets(piece, square(row, col)))]
+
+    def _pseudo_targets(self, piece, sq):
+        colour, piece_type = piece[0], piece[2:]
+        own = self.occupancy[colour]
+        enemy = self.occupancy["b" if colour == "w" else "w"]
+        occupied = own | enemy
+
+        if piece_type == "pawn":
+            targets = PAWN_ATTACKS[colour][sq] & enemy
+            if self.en_passant_target:
+                ep_bit = 1 << square(*self.en_passant_target)
+                targets |= PAWN_ATTACKS[colour][sq] & ep_bit
+            one = sq - 8 if colour == "w" else sq + 8
+            if 0 <= one < 64 and not occupied >> one & 1:
+                targets |= 1 << one
+                start_row = 6 if colour == "w" else 1
+                two = sq - 16 if colour == "w" else sq + 16
+                if sq >> 3 == start_row and not occupied >> two & 1:
+                    targets |= 1 << two
+            return targets
+        if piece_type == "knight": return KNIGHT_ATTACKS[sq] & ~own
+        if piece_type == "bishop": return bishop_attacks(sq, occupied) & ~own
+        if piece_type == "rook":   return rook_attacks(sq, occupied) & ~own
+        if piece_type == "queen":  return queen_attacks(sq, occupied) & ~own
+        if piece_type == "king":   return KING_ATTACKS[sq] & ~own
+        return 0
+
+    def _castling_targets(self, colour, sq, occupied, attacked):
+        back_row = 7 if colour == "w" else 0
+        if sq != square(back_row, 4) or attacked >> sq & 1:
+            return 0
+
+        rights = self.castling_rights[colour]
+        targets = 0
+        base = back_row * 8
+        if rights["kingside"] and not occupied & (0b11 << (base + 5)) and not attacked & (0b11 << (base + 5)):
+            targets |= 1 << (base + 6)
+        if rights["queenside"] and not occupied & (0b111 << (base + 1)) and not attacked & (0b11 << (base + 2)):
+            targets |= 1 << (base + 2)
+        return targets
+
+    def _legality(self):
+        # Checkers, pinned pieces and enemy attacks as masks, computed once per position
+        if self._legality_info is not None:
+            return self._legality_info
+
+        colour = self.turn
+        enemy = "b" if colour == "w" else "w"
+        bb = self.bitboards
+        own = self.occupancy[colour]
+        occupied = own | self.occupancy[enemy]
+        king_sq = bb[f"{colour}_king"].bit_length() - 1
+        pawn, knight, bishop, rook, queen, king = PIECE_NAMES[enemy]
+
+        checkers = self.attackers(king_sq, enemy, occupied)
+        if not checkers:
+            check_mask = MASK64
+        elif checkers & (checkers - 1):
+            check_mask = 0
+        else:
+            check_mask = checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+
+        pinned = 0
+        snipers = ((rook_attacks(king_sq, self.occupancy[enemy]) & (bb[rook] | bb[queen]))
+                 | (bishop_attacks(king_sq, self.occupancy[enemy]) & (bb[bishop] | bb[queen])))
+        for sniper in iter_squares(snipers):
+            blockers = BETWEEN[king_sq][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+
+        # The king is removed so it can't step back along a slider's ray
+        through_king = occupied & ~(1 << king_sq)
+        attacked = KING_ATTACKS[bb[king].bit_length() - 1] if bb[king] else 0
+        for sq in iter_squares(bb[pawn]):   attacked |= PAWN_ATTACKS[enemy][sq]
+        for sq in iter_squares(bb[knight]): attacked |= KNIGHT_ATTACKS[sq]
+        for sq in iter_squares(bb[bishop] | bb[queen]): attacked |= bishop_attacks(sq, through_king)
+        for sq in iter_squares(bb[rook] | bb[queen]):   attacked |= rook_attacks(sq, through_king)
+
+        self._legality_info = (king_sq, checkers, check_mask, pinned, attacked)
+        return self._legality_info
+
+    @timed()
+    def get_legal_moves(self, row, col):
+        piece = self.board[row][col]
+
+        if not piece or piece[0] != self.turn:
+            return []
+
+        return [divmod(to_sq, 8) for to_sq in iter_squares(self._legal_targets(piece, square(row, col)))]
+
+    @timed()
+    def legal_moves(self):
+        if self._legal_moves is None:
+            colour = self.turn
+            promotion_row = 1 if colour == "w" else 6
+            moves = []
+            for piece in PIECE_NAMES[colour]:
+                promotes = piece.endswith("pawn")
+                for from_sq in iter_squares(self.bitboards[piece]):
+                    base = from_sq * 64
+                    if promotes and from_sq >> 3 == promotion_row:
+                        for to_sq in iter_squares(self._legal_targets(piece, from_sq)):
+                            moves.extend((base + to_sq, base + to_sq | 1 << 12, base + to_sq | 2 << 12, base + to_sq | 3 << 12))
+                    else:
+                        moves.extend(base + to_sq for to_sq in iter_squares(self._legal_targets(piece, from_sq)))
+            self._legal_moves = moves
+        return self._legal_moves
+
+    def _legal_targets(self, piece, from_sq):
+        colour = piece[0]
+        own = self.occupancy[colour]
+        king_sq, checkers, check_mask, pinned, attacked = self._legality()
+
+        if piece.endswith("king"):
+            occupied = own | self.occupancy["b" if colour == "w" else "w"]
+            return (KING_ATTACKS[from_sq] & ~own & ~attacked) | self._castling_targets(colour, from_sq, occupied, attacked)
+
+        targets = self._pseudo_targets(piece, from_sq)
+
+        ep_bit = 0
+        if self.en_passant_target and piece.endswith("pawn"):
+            ep_bit = targets & (1 << square(*self.en_passant_target))
+            targets &= ~ep_bit
+
+        targets &= check_mask
+        if pinned >> from_sq & 1:
+            targets &= LINE[king_sq][from_sq]
+
+        if ep_bit and self._is_legal_en_passant(colour, from_sq, ep_bit.bit_length() - 1, king_sq):
+            targets |= ep_bit
+
+        return targets
+
+    def _is_legal_en_passant(self, colour, from_sq, to_sq, king_sq):
+        # Both pawns leave the same rank, so test the position after the capture directly
+        enemy = "b" if colour == "w" else "w"
+        captured = 1 << (to_sq + 8 if colour == "w" else to_sq - 8)
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        after = (occupied & ~(1 << from_sq) & ~captured) | (1 << to_sq)
+        return not self.attackers(king_sq, enemy, after, exclude=captured)
@@ -1,6 +1,11 @@
+import numpy as np
+
 from game.rules import *
-from game.move import Move
-from game.state import get_position_signature, encode_board_state
+from game.move import Move, decode_move
+from game.state import ZOBRIST_PIECES, ZOBRIST_TURN, PIECE_TO_CHANNEL, zobrist_state_key, compute_hash, build_planes, update_state_planes
+from tools.instrument import timed
+
+FEN_PIECES = {"p": "pawn", "n": "knight", "b": "bishop", "r": "rook", "q": "queen", "k": "king"}
 
 class ChessBoard:
     def __init__(self):
@@ -31,19 +36,71 @@ class ChessBoard:
 
         self.move_history = []
 
-        self.position_history = {}
         self.halfmove_clock = 0
         self.fullmove_number = 1
 
         self.game_over = False
         self.result = None
 
+        self._legality_info = None
+        self._legal_moves = None
+        self._legal_indices = None
+
+        # Zobrist key of the position, kept up to date by every move
+        self.hash = compute_hash(self)
+        self.position_history = [self.hash]
+
+        # Encoder planes, kept current move by move
+        build_planes(self)
+
+    def load_fen(self, fen):
+        fields = fen.split()
+        if len(fields) < 4 or len(fields[0].split("/")) != 8:
+            raise ValueError(f"Invalid FEN: {fen}")
+        placement, turn, castling, en_passant = fields[:4]
+
+        self.reset_board()
+        self.board = [[""] * 8 for _ in range(8)]
+        for row, rank in enumerate(placement.split("/")):
+            col = 0
+            for char in rank:
+                if char.isdigit():
+                    col += int(char)
+                    continue
+                piece = f"{'w' if char.isupper() else 'b'}_{FEN_PIECES[char.lower()]}"
+                self.board[row][col] = piece
+                if   piece == "w_king": self.white_king_pos = (row, col)
+                elif piece == "b_king": self.black_king_pos = (row, col)
+                col += 1
+
+        self.turn = turn
+        self.castling_rights = {
+            "w": {"kingside": "K" in castling, "queenside": "Q" in castling},
+            "b": {"kingside": "k" in castling, "queenside": "q" in castling}
+        }
+        self.en_passant_target = None if en_passant == "-" else (8 - int(en_passant[1]), "abcdefgh".index(en_passant[0]))
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+
+        self.hash = compute_hash(self)
+        self.position_history = [self.hash]
+        build_planes(self)
     
     def get_piece(self, row, col):
         return self.board[row][col]
     
     def get_board_state(self):
         return self.board
+
+    def _set_piece(self, row, col, piece):
+        old = self.board[row][col]
+        if old:
+            self.hash ^= ZOBRIST_PIECES[old][row * 8 + col]
+            self.planes[PIECE_TO_CHANNEL[old], row, col] = 0.0
+        if piece:
+            self.hash ^= ZOBRIST_PIECES[piece][row * 8 + col]
+            self.planes[PIECE_TO_CHANNEL[piece], row, col] = 1.0
+        self.board[row][col] = piece
     
     def generate_piece_moves(self, row, col):
         piece = self.get_piece(row, col)
@@ -62,36 +119,90 @@ class ChessBoard:
 
         return []
     
+    @timed()
     def get_legal_moves(self, row, col):
         piece = self.get_piece(row, col)
         
         if not piece or piece[0] != self.turn:
             return []
-    
-        legal_moves = []
 
-        for r, c in self.generate_piece_moves(row, col):
-            from_cell_temp = self.board[row][col]
-            to_cell_temp = self.board[r][c]
+        checkers, evasions, pins, attacked = self._legality()
 
-            # Simulate Move
-            self.board[r][c]     = from_cell_temp
-            self.board[row][col] = ""
-            if   piece == "w_king": self.white_king_pos = (r, c)
-            elif piece == "b_king": self.black_king_pos = (r, c)
+        # King moves only need the attack map, castling checks its path against it too
+        if piece.endswith("king"):
+            is_attacked = lambda colour, r, c: (r, c) in attacked
+            return [move for move in get_king_moves(self.board, row, col, self.turn, self.castling_rights, is_attacked)
+                    if move not in attacked]
 
-            if not self.is_in_check(self.turn):
-                legal_moves.append((r, c))
+        if len(checkers) > 1:
+            return []
 
-            # Undo
-            self.board[r][c]     = to_cell_temp
-            self.board[row][col] = from_cell_temp
-            if   piece == "w_king": self.white_king_pos = (row, col)
-            elif piece == "b_king": self.black_king_pos = (row, col)
+        legal_moves = []
+
+        for r, c in self.generate_piece_moves(row, col):
+            if piece.endswith("pawn") and (r, c) == self.en_passant_target:
+                if self._is_legal_en_passant(row, col, r, c):
+                    legal_moves.append((r, c))
+                continue
+            if checkers and (r, c) not in evasions:
+                continue
+            if (row, col) in pins and (r, c) not in pins[(row, col)]:
+                continue
+            legal_moves.append((r, c))
 
-        
         return legal_moves
 
+    @timed()
+    def legal_moves(self):
+        # Every legal move as a compact int (see game.move), generated once per position
+        if self._legal_moves is None:
+            moves = []
+            for row in range(8):
+                for col in range(8):
+                    piece = self.board[row][col]
+                    if not piece or piece[0] != self.turn:
+                        continue
+                    promotes = piece.endswith("pawn") and row == (1 if self.turn == "w" else 6)
+                    for r, c in self.get_legal_moves(row, col):
+                        move = (row * 8 + col) * 64 + r * 8 + c
+                        moves.append(move)
+                        if promotes:
+                            moves.extend((move | 1 << 12, move | 2 << 12, move | 3 << 12))
+            self._legal_moves = moves
+        return self._legal_moves
+
+    def legal_indices(self):
+        # Policy indices (from * 64 + to) of the legal moves as an int64 array, in legal_moves order.
+        # Underpromotions share their queen promotion's index, so only the plain moves are kept.
+        if self._legal_indices is None:
+            self._legal_indices = np.array([move for move in self.legal_moves() if move < 4096], dtype=np.int64)
+        return self._legal_indices
+
+    def _legality(self):
+        # Checkers, pins and enemy attacks, computed once per position
+        if self._legality_info is None:
+            king_row, king_col = self.white_king_pos if self.turn == "w" else self.black_king_pos
+            enemy = "b" if self.turn == "w" else "w"
+            checkers, evasions, pins = get_checks_and_pins(self.board, king_row, king_col, self.turn)
+            attacked = get_attacked_squares(self.board, enemy, ignore=(king_row, king_col))
+            self._legality_info = (checkers, evasions, pins, attacked)
+        return self._legality_info
+
+    def _is_legal_en_passant(self, row, col, to_row, to_col):
+        # Both pawns leave the same rank, so pins and checks can't be read off the masks
+        pawn = self.board[row][col]
+        captured = self.board[row][to_col]
+        self.board[to_row][to_col] = pawn
+        self.board[row][col] = ""
+        self.board[row][to_col] = ""
+
+        legal = not self.is_in_check(self.turn)
+
+        self.board[to_row][to_col] = ""
+        self.board[row][col] = pawn
+        self.board[row][to_col] = captured
+        return legal
+
     def make_move(self, from_row, from_col, to_row, to_col, legal_moves, promotion=None):
 
         if self.game_over:
@@ -99,105 +210,155 @@ class ChessBoard:
 
         if (to_row, to_col) not in legal_moves:
             return False
-        
+
         piece = self.get_piece(from_row, from_col)
-        target = self.get_piece(to_row, to_col)
-        move = Move(from_row, from_col, to_row, to_col, piece, target)
+        self.push(Move(from_row, from_col, to_row, to_col, piece, promotion=promotion))
+
+        return True
+
+    @timed()
+    def push(self, move):
+        # Plays a legal Move or compact move and records what pop needs to restore the position
+        if isinstance(move, int):
+            from_row, from_col, to_row, to_col, promotion = decode_move(move)
+            move = Move(from_row, from_col, to_row, to_col, self.board[from_row][from_col], promotion=promotion)
+        from_row, from_col, to_row, to_col = move.from_row, move.from_col, move.to_row, move.to_col
+        piece = self.board[from_row][from_col]
+        target = self.board[to_row][to_col]
+        colour = self.turn
+        rights = self.castling_rights
+
+        move.piece = piece
+        move.captured = target or None
+        move.prev_castling_rights = (rights["w"]["kingside"], rights["w"]["queenside"],
+                                     rights["b"]["kingside"], rights["b"]["queenside"])
+        move.prev_en_passant = self.en_passant_target
+        move.prev_halfmove_clock = self.halfmove_clock
+        self.hash ^= zobrist_state_key(self)
 
         # Handle Castling
         if piece.endswith("king"):
             if abs(to_col - from_col) == 2:
                 move.is_castling = True
                 if to_col == 6: # kingside
-                    self.board[from_row][5] = self.board[from_row][7]
-                    self.board[from_row][7] = ""
+                    self._set_piece(from_row, 5, self.board[from_row][7])
+                    self._set_piece(from_row, 7, "")
                 if to_col == 2: # queenside
-                    self.board[from_row][3] = self.board[from_row][0]
-                    self.board[from_row][0] = ""
+                    self._set_piece(from_row, 3, self.board[from_row][0])
+                    self._set_piece(from_row, 0, "")
+
+            if colour == "w": self.white_king_pos = (to_row, to_col)
+            else:             self.black_king_pos = (to_row, to_col)
+            rights[colour]["kingside"]  = False
+            rights[colour]["queenside"] = False
 
-                self.castling_rights[self.turn]["kingside"]  = False
-                self.castling_rights[self.turn]["queenside"] = False
-            
         # Handle en passant 
         if piece.endswith("pawn") and (to_row, to_col) == self.en_passant_target:
             move.is_en_passant = True
-            self.board[from_row][to_col] = ""
+            move.captured = self.board[from_row][to_col]
+            self._set_piece(from_row, to_col, "")
         
         # Handle promotion
-        if piece.endswith("pawn"):
-            final_rank = 0 if piece[0] == "w" else 7
-            if to_row == final_rank:
-                move.promotion = promotion if promotion in ("queen", "rook", "bishop", "knight") else "queen"
-                piece = f"{piece[0]}_{promotion}"
+        if piece.endswith("pawn") and to_row == (0 if colour == "w" else 7):
+            move.promotion = move.promotion if move.promotion in ("queen", "rook", "bishop", "knight") else "queen"
+            piece = f"{colour}_{move.promotion}"
+        else:
+            move.promotion = None
 
         # Execute Move
-        self.board[to_row][to_col] = piece
-        self.board[from_row][from_col] = ""
-
-        # Update castling rights and king position
-        if piece == "w_king":
-            self.white_king_pos = (to_row, to_col)
-            self.castling_rights["w"]["kingside"]  = False
-            self.castling_rights["w"]["queenside"] = False
-        elif piece == "b_king":
-            self.black_king_pos = (to_row, to_col)
-            self.castling_rights["b"]["kingside"]  = False
-            self.castling_rights["b"]["queenside"] = False
-
-        # Update castling rights for rooks
-        if piece.endswith("rook"):
-            if from_row == 7:
-                self.castling_rights[self.turn]["kingside"]  = False
-            if from_row == 0:
-                self.castling_rights[self.turn]["queenside"] = False
+        self._set_piece(to_row, to_col, piece)
+        self._set_piece(from_row, from_col, "")
+
+        # A rook leaving its corner, or being captured there, loses that side's castling right
+        for row, col in ((from_row, from_col), (to_row, to_col)):
+            if row in (0, 7) and col in (0, 7):
+                rights["w" if row == 7 else "b"]["kingside" if col == 7 else "queenside"] = False
 
         # Update en passant target
-        if piece.endswith("pawn") and abs(to_row - from_row) == 2:
+        if move.piece.endswith("pawn") and abs(to_row - from_row) == 2:
             self.en_passant_target = ((from_row + to_row) // 2, to_col)
         else:
             self.en_passant_target = None
 
         # Update clocks
-        self.halfmove_clock = 0 if target or piece.endswith("pawn") else self.halfmove_clock + 1
-        if self.turn == "b": self.fullmove_number += 1
+        self.halfmove_clock = 0 if move.captured or move.piece.endswith("pawn") else self.halfmove_clock + 1
+        if colour == "b": self.fullmove_number += 1
 
         # Switch turn
-        self.turn = "b" if self.turn == "w" else "w"
-
-        # Update FEN and position history
-        signature = get_position_signature(self)
-        self.position_history[signature] = self.position_history.get(signature, 0) + 1
+        self.turn = "b" if colour == "w" else "w"
+        self._legality_info = None
+        self._legal_moves = None
+        self._legal_indices = None
+
+        # Update hash, position history and encoder planes
+        self.hash ^= zobrist_state_key(self) ^ ZOBRIST_TURN
+        self.position_history.append(self.hash)
+        update_state_planes(self, move.prev_en_passant)
     
         # Save move
         self.move_history.append(move)
 
-        return True
+        return move
+
+    @timed()
+    def pop(self):
+        # Takes back the last pushed move, restoring the exact previous state
+        move = self.move_history.pop()
+        self.position_history.pop()
+        self.hash ^= zobrist_state_key(self)
+
+        colour = "b" if self.turn == "w" else "w"
+        from_row, from_col, to_row, to_col = move.from_row, move.from_col, move.to_row, move.to_col
+
+        # Undo piece placement, the captured piece returns to its square
+        self._set_piece(from_row, from_col, move.piece)
+        if move.is_en_passant:
+            self._set_piece(to_row, to_col, "")
+            self._set_piece(from_row, to_col, move.captured)
+        else:
+            self._set_piece(to_row, to_col, move.captured or "")
+
+        if move.is_castling:
+            if to_col == 6:
+                self._set_piece(from_row, 7, self.board[from_row][5])
+                self._set_piece(from_row, 5, "")
+            if to_col == 2:
+                self._set_piece(from_row, 0, self.board[from_row][3])
+                self._set_piece(from_row, 3, "")
+
+        if move.piece == "w_king": self.white_king_pos = (from_row, from_col)
+        elif move.piece == "b_king": self.black_king_pos = (from_row, from_col)
+
+        # Restore irreversible state
+        en_passant = self.en_passant_target
+        rights = self.castling_rights
+        (rights["w"]["kingside"], rights["w"]["queenside"],
+         rights["b"]["kingside"], rights["b"]["queenside"]) = move.prev_castling_rights
+        self.en_passant_target = move.prev_en_passant
+        self.halfmove_clock = move.prev_halfmove_clock
+        if colour == "b": self.fullmove_number -= 1
+
+        self.turn = colour
+        self.hash ^= zobrist_state_key(self) ^ ZOBRIST_TURN
+        update_state_planes(self, en_passant)
+        self._legality_info = None
+        self._legal_moves = None
+        self._legal_indices = None
+        self.game_over = False
+        self.result = None
+
+        return move
     
     def is_in_check(self, colour):
-        king_pos = self.white_king_pos if colour == "w" else self.black_king_pos
+        king_row, king_col = self.white_king_pos if colour == "w" else self.black_king_pos
         enemy_colour = "b" if colour == "w" else "w"
-
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece(row, col)
-                if piece and not piece.endswith("king") and piece[0] == enemy_colour:
-                    if king_pos in self.generate_piece_moves(row, col):
-                        return True
-                    
-        return False
+        return is_square_attacked(self.board, king_row, king_col, enemy_colour)
     
     def is_in_check_pos(self, colour, row, col):
         enemy_colour = "b" if colour == "w" else "w"
-
-        for r in range(8):
-            for c in range(8):
-                piece = self.get_piece(r, c)
-                if piece and not piece.endswith("king") and piece[0] == enemy_colour:
-                    if (row, col) in self.generate_piece_moves(r, c):
-                        return True
-                    
-        return False
+        return is_square_attacked(self.board, row, col, enemy_colour)
     
+    @timed()
     def is_game_over(self):
         draw_reason = self.is_draw()
         if draw_reason:
@@ -205,12 +366,8 @@ class ChessBoard:
             self.result = f"draw: {draw_reason}"
             return self.result
     
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece(row, col)
-                if piece and piece[0] == self.turn:
-                    if self.get_legal_moves(row, col):
-                        return False
+        if self.legal_moves():
+            return False
         
         if self.is_in_check(self.turn):
             self.result = "checkmate"
@@ -222,13 +379,25 @@ class ChessBoard:
     def is_draw(self):
         if self.halfmove_clock >= 100:
             return "50-move rule"
-        for fen, count in self.position_history.items():
-            if count >= 3:
-                return "threefold repetition"
+        if self.is_repetition(3):
+            return "threefold repetition"
         if self._is_insufficient_material():
             return "insufficient material"
         return None  
     
+    def is_repetition(self, count=3):
+        # Only positions since the last capture or pawn move can repeat, and only with the same side to move
+        history = self.position_history
+        last = len(history) - 1
+        stop = max(last - self.halfmove_clock, 0)
+        seen = 1
+        for i in range(last - 2, stop - 1, -2):
+            if history[i] == self.hash:
+                seen += 1
+                if seen >= count:
+                    return True
+        return False
+
     def _is_insufficient_material(self): # Not tested yet
         pieces = []
         bishop_colors = []
@@ -259,3 +428,19 @@ class ChessBoard:
                     return True  # Same color bishops
 
         return False
+
+
+BACKENDS = ("mailbox", "bitboard")
+
+def create_board(backend="mailbox", fen=None):
+    if backend == "mailbox":
+        board = ChessBoard()
+    elif backend == "bitboard":
+        from game.bitboard import BitboardChessBoard
+        board = BitboardChessBoard()
+    else:
+        raise ValueError(f"Unknown board backend: {backend}")
+
+    if fen:
+        board.load_fen(fen)
+    return board
@@ -12,6 +12,11 @@ class Move:
     is_castling: bool = False
     is_en_passant: bool = False
 
+    # State before the move, so ChessBoard.pop can restore it
+    prev_castling_rights: tuple = None
+    prev_en_passant: tuple = None
+    prev_halfmove_clock: int = 0
+
     def __repr__(self):
         move_type = ""
         if self.is_castling:
@@ -20,4 +25,28 @@ class Move:
             move_type = " (en passant)"
         elif self.promotion:
             move_type = f" (promotion to {self.promotion})"
-        return f"{self.piece}: ({self.src_row}, {self.src_col}) -> ({self.dest_row}, {self.dest_col}){move_type}"
+        return f"{self.piece}: ({self.from_row}, {self.from_col}) -> ({self.to_row}, {self.to_col}){move_type}"
+
+
+# Compact moves are ints: from_square * 64 + to_square, which is also the 4096 policy index.
+# Underpromotions add their PROMOTIONS index in bits 12-13, so a plain index promotes to a queen.
+PROMOTIONS = ("queen", "rook", "bishop", "knight")
+
+def encode_move(from_row, from_col, to_row, to_col, promotion=None):
+    move = (from_row * 8 + from_col) * 64 + to_row * 8 + to_col
+    if promotion in PROMOTIONS[1:]:
+        move |= PROMOTIONS.index(promotion) << 12
+    return move
+
+def decode_move(move):
+    from_sq, to_sq = (move >> 6) & 63, move & 63
+    promotion = PROMOTIONS[move >> 12] if move >> 12 else None
+    return from_sq // 8, from_sq % 8, to_sq // 8, to_sq % 8, promotion
+
+def move_to_uci(move, piece=""):
+    # Pass the moving piece to spell out queen promotions, which a bare index leaves implicit
+    from_row, from_col, to_row, to_col, promotion = decode_move(move)
+    if not promotion and piece.endswith("pawn") and to_row in (0, 7):
+        promotion = "queen"
+    name = f"{'abcdefgh'[from_col]}{8 - from_row}{'abcdefgh'[to_col]}{8 - to_row}"
+    return name + ({"queen": "q", "rook": "r", "bishop": "b", "knight": "n"}[promotion] if promotion else "")
@@ -0,0 +1,107 @@
+import argparse
+import sys
+import time
+
+from game.board import create_board, BACKENDS
+from game.move import decode_move, move_to_uci
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Standard perft positions with known node counts per depth
+SUITE = [
+    ("start position",         START_FEN,                                                                {1: 20, 2: 400, 3: 8902, 4: 197281}),
+    ("kiwipete",               "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",   {1: 48, 2: 2039, 3: 97862}),
+    ("rook endgame, pins",     "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",                              {1: 14, 2: 191, 3: 2812, 4: 43238}),
+    ("promotions",             "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",       {1: 6, 2: 264, 3: 9467}),
+    ("promotions mirrored",    "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",       {1: 6, 2: 264, 3: 9467}),
+    ("discovered promotion",   "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",              {1: 44, 2: 1486, 3: 62379}),
+    ("middlegame",             "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", {1: 46, 2: 2079, 3: 89890}),
+    ("illegal en passant",     "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",                                      {1: 18, 2: 92, 3: 1670, 4: 10138, 6: 1134888}),
+    ("en passant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",                                    {1: 15, 2: 126, 3: 1928, 4: 13931, 6: 1440467}),
+    ("short castle check",     "5k2/8/8/8/8/8/8/4K2R w K - 0 1",                                         {1: 15, 2: 66, 3: 1198, 4: 6399, 6: 661072}),
+    ("long castle check",      "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",                                         {1: 16, 2: 71, 3: 1286, 4: 7418, 6: 803711}),
+    ("castling rights",        "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",                              {1: 26, 2: 1141, 3: 27826, 4: 1274206}),
+    ("castling prevented",     "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",                               {1: 44, 2: 1494, 3: 50509, 4: 1720476}),
+    ("promote out of check",   "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",                                      {1: 11, 2: 133, 3: 1442, 4: 19174, 6: 3821001}),
+    ("promote to check",       "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",                                         {1: 9, 2: 40, 3: 472, 4: 2661, 5: 38983, 6: 217342}),
+    ("underpromote to check",  "8/P1k5/K7/8/8/8/8/8 w - - 0 1",                                          {1: 6, 2: 27, 3: 273, 4: 1329, 5: 18135, 6: 92683}),
+    ("self stalemate",         "K1k5/8/P7/8/8/8/8/8 w - - 0 1",                                          {1: 2, 2: 6, 3: 13, 4: 63, 5: 382, 6: 2217}),
+    ("stalemate and mate",     "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",                                      {1: 37, 2: 183, 3: 6559, 4: 23527}),
+]
+
+
+def perft(board, depth):
+    moves = board.legal_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+def divide(board, depth):
+    counts = {}
+    for move in board.legal_moves():
+        from_row, from_col = decode_move(move)[:2]
+        name = move_to_uci(move, board.board[from_row][from_col])
+        board.push(move)
+        counts[name] = perft(board, depth - 1)
+        board.pop()
+    return counts
+
+def run_suite(backend="bitboard", max_nodes=100_000):
+    # Runs each position at the deepest known depth that fits the node budget, returns the failures
+    failures = []
+    total_nodes, total_time = 0, 0.0
+    for name, fen, known in SUITE:
+        depths = [depth for depth, nodes in known.items() if nodes <= max_nodes]
+        if not depths:
+            print(f"{name:<24} skipped (smallest known count exceeds {max_nodes} nodes)")
+            continue
+
+        depth = max(depths)
+        board = create_board(backend, fen)
+        start = time.perf_counter()
+        nodes = perft(board, depth)
+        elapsed = time.perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+
+        status = "ok" if nodes == known[depth] else f"FAIL (expected {known[depth]})"
+        print(f"{name:<24} depth {depth}  {nodes:>9} nodes  {nodes / elapsed:>10.0f} nodes/s  {status}")
+        if nodes != known[depth]:
+            failures.append((name, depth, nodes, known[depth]))
+
+    if total_time:
+        print(f"Total: {total_nodes} nodes in {total_time:.2f}s ({total_nodes / total_time:.0f} nodes/s)")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="app.py perft", description="Move generator correctness and speed check")
+    parser.add_argument("--fen", help="position to search instead of running the suite")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print node counts per root move")
+    parser.add_argument("--backend", choices=BACKENDS, default="bitboard")
+    parser.add_argument("--max-nodes", type=int, default=100_000, help="node budget per suite position")
+    args = parser.parse_args(argv)
+
+    if not args.fen:
+        failures = run_suite(args.backend, args.max_nodes)
+        if failures:
+            sys.exit(1)
+        return
+
+    board = create_board(args.backend, args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(board, args.depth)
+        for name, nodes in sorted(counts.items()):
+            print(f"{name}: {nodes}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(board, args.depth)
+    elapsed = time.perf_counter() - start
+    print(f"Nodes: {nodes}  Time: {elapsed:.2f}s  ({nodes / elapsed:.0f} nodes/s)")
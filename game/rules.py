@@ -114,4 +114,121 @@ def get_king_moves(board, row, col, colour, castling_rights, is_in_check_pos_fun
                 moves.append((back_row, 2))
 
 
-    return moves
\ No newline at end of file
+    return moves
+
+# Legality helpers: looking outward from a square instead of generating every enemy move
+
+KNIGHT_DELTAS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_DELTAS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+def is_square_attacked(board, row, col, by_colour):
+    # A by_colour pawn attacking (row, col) stands one row behind it
+    pawn_row = row + 1 if by_colour == "w" else row - 1
+    if 0 <= pawn_row < 8:
+        for pawn_col in (col - 1, col + 1):
+            if 0 <= pawn_col < 8 and board[pawn_row][pawn_col] == f"{by_colour}_pawn":
+                return True
+
+    for deltas, piece in ((KNIGHT_DELTAS, f"{by_colour}_knight"), (KING_DELTAS, f"{by_colour}_king")):
+        for d_row, d_col in deltas:
+            r, c = row + d_row, col + d_col
+            if 0 <= r < 8 and 0 <= c < 8 and board[r][c] == piece:
+                return True
+
+    for directions, slider in ((ROOK_DIRECTIONS, f"{by_colour}_rook"), (BISHOP_DIRECTIONS, f"{by_colour}_bishop")):
+        for d_row, d_col in directions:
+            r, c = row + d_row, col + d_col
+            while 0 <= r < 8 and 0 <= c < 8:
+                target = board[r][c]
+                if target:
+                    if target == slider or target == f"{by_colour}_queen":
+                        return True
+                    break
+                r += d_row
+                c += d_col
+
+    return False
+
+def get_attacked_squares(board, colour, ignore=None):
+    # Every square attacked (or defended) by colour, the ignore square is seen through so a king can't hide on its own ray
+    attacked = set()
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if not piece or piece[0] != colour:
+                continue
+
+            piece_type = piece[2:]
+            if piece_type == "pawn":
+                pawn_row = row - 1 if colour == "w" else row + 1
+                for pawn_col in (col - 1, col + 1):
+                    if 0 <= pawn_row < 8 and 0 <= pawn_col < 8:
+                        attacked.add((pawn_row, pawn_col))
+            elif piece_type in ("knight", "king"):
+                for d_row, d_col in (KNIGHT_DELTAS if piece_type == "knight" else KING_DELTAS):
+                    r, c = row + d_row, col + d_col
+                    if 0 <= r < 8 and 0 <= c < 8:
+                        attacked.add((r, c))
+            else:
+                directions = []
+                if piece_type in ("rook", "queen"):   directions += ROOK_DIRECTIONS
+                if piece_type in ("bishop", "queen"): directions += BISHOP_DIRECTIONS
+                for d_row, d_col in directions:
+                    r, c = row + d_row, col + d_col
+                    while 0 <= r < 8 and 0 <= c < 8:
+                        attacked.add((r, c))
+                        if board[r][c] and (r, c) != ignore:
+                            break
+                        r += d_row
+                        c += d_col
+
+    return attacked
+
+def get_checks_and_pins(board, king_row, king_col, colour):
+    # Returns the checking squares, the squares that block or capture a single check,
+    # and each pinned piece mapped to the ray it may still move along
+    enemy = "b" if colour == "w" else "w"
+    checkers = []
+    evasions = set()
+    pins = {}
+
+    pawn_row = king_row - 1 if colour == "w" else king_row + 1
+    if 0 <= pawn_row < 8:
+        for pawn_col in (king_col - 1, king_col + 1):
+            if 0 <= pawn_col < 8 and board[pawn_row][pawn_col] == f"{enemy}_pawn":
+                checkers.append((pawn_row, pawn_col))
+                evasions.add((pawn_row, pawn_col))
+
+    for d_row, d_col in KNIGHT_DELTAS:
+        r, c = king_row + d_row, king_col + d_col
+        if 0 <= r < 8 and 0 <= c < 8 and board[r][c] == f"{enemy}_knight":
+            checkers.append((r, c))
+            evasions.add((r, c))
+
+    for directions, slider in ((ROOK_DIRECTIONS, f"{enemy}_rook"), (BISHOP_DIRECTIONS, f"{enemy}_bishop")):
+        for d_row, d_col in directions:
+            ray = []
+            blocker = None
+            r, c = king_row + d_row, king_col + d_col
+            while 0 <= r < 8 and 0 <= c < 8:
+                ray.append((r, c))
+                target = board[r][c]
+                if target:
+                    if target[0] == colour:
+                        if blocker:
+                            break
+                        blocker = (r, c)
+                    else:
+                        if target == slider or target == f"{enemy}_queen":
+                            if blocker:
+                                pins[blocker] = set(ray)
+                            else:
+                                checkers.append((r, c))
+                                evasions.update(ray)
+                        break
+                r += d_row
+                c += d_col
+
+    return checkers, evasions, pins
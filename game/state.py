@@ -1,53 +1,94 @@
+import random
 import numpy as np
 
-def get_position_signature(chessboard):
-        board = chessboard.get_board_state()
-        piece_rows = []
-        for row in board:
-            piece_rows.append("".join(piece or "." for piece in row))
-        board_str = "/".join(piece_rows)
-        
-        castling = (
-            f"{int(chessboard.castling_rights['w']['kingside'])}"
-            f"{int(chessboard.castling_rights['w']['queenside'])}"
-            f"{int(chessboard.castling_rights['b']['kingside'])}"
-            f"{int(chessboard.castling_rights['b']['queenside'])}"
-        )
-        
-        ep = chessboard.en_passant_target or (-1, -1)
-        
-        return f"{board_str} {chessboard.turn} {castling} {ep}"
+from tools.instrument import timed
 
-def encode_board_state(chessboard):
+# Zobrist keys, seeded so every process hashes a position to the same 64-bit key
+_zobrist_rng = random.Random(0x601DF154)
+ZOBRIST_PIECES = {
+    f"{colour}_{piece_type}": [_zobrist_rng.getrandbits(64) for _ in range(64)]
+    for colour in ("w", "b") for piece_type in ("pawn", "knight", "bishop", "rook", "queen", "king")
+}
+ZOBRIST_CASTLING = [_zobrist_rng.getrandbits(64) for _ in range(16)]
+ZOBRIST_EN_PASSANT = [_zobrist_rng.getrandbits(64) for _ in range(8)]
+ZOBRIST_TURN = _zobrist_rng.getrandbits(64)
+
+def zobrist_state_key(chessboard):
+    # Castling and en passant part of the key, xor-ed out before and back in after a move
+    rights = chessboard.castling_rights
+    castling = (rights["w"]["kingside"] | rights["w"]["queenside"] << 1
+              | rights["b"]["kingside"] << 2 | rights["b"]["queenside"] << 3)
+    key = ZOBRIST_CASTLING[castling]
+    if chessboard.en_passant_target:
+        key ^= ZOBRIST_EN_PASSANT[chessboard.en_passant_target[1]]
+    return key
+
+def compute_hash(chessboard):
     board = chessboard.get_board_state()
-    tensor = np.zeros((8, 8, 18), dtype=np.float32)
+    key = zobrist_state_key(chessboard)
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece:
+                key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+    if chessboard.turn == "b":
+        key ^= ZOBRIST_TURN
+    return key
 
-    piece_to_channel = {
-        "w_pawn": 0, "w_knight": 1, "w_bishop": 2,
-        "w_rook": 3, "w_queen": 4, "w_king": 5,
-        "b_pawn": 6, "b_knight": 7, "b_bishop": 8,
-        "b_rook": 9, "b_queen": 10, "b_king": 11,
-    }
+# Channels-first (18, 8, 8) planes: 12 piece planes, side to move, 4 castling rights, en passant square
+PIECE_TO_CHANNEL = {
+    "w_pawn": 0, "w_knight": 1, "w_bishop": 2,
+    "w_rook": 3, "w_queen": 4, "w_king": 5,
+    "b_pawn": 6, "b_knight": 7, "b_bishop": 8,
+    "b_rook": 9, "b_queen": 10, "b_king": 11,
+}
+CASTLING_CHANNELS = ((13, "w", "kingside"), (14, "w", "queenside"), (15, "b", "kingside"), (16, "b", "queenside"))
+
+def build_planes(chessboard):
+    board = chessboard.get_board_state()
+    planes = np.zeros((18, 8, 8), dtype=np.float32)
 
     for row in range(8):
         for col in range(8):
             piece = board[row][col]
-            if piece in piece_to_channel:
-                tensor[row, col, piece_to_channel[piece]] = 1.0
-    
+            if piece in PIECE_TO_CHANNEL:
+                planes[PIECE_TO_CHANNEL[piece], row, col] = 1.0
+
+    chessboard.planes = planes
+    update_state_planes(chessboard, None)
+    return planes
+
+def update_state_planes(chessboard, prev_en_passant):
+    # Piece planes are kept current by ChessBoard._set_piece, this refreshes the rest after a move
+    planes = chessboard.planes
+
     # Turn
-    if chessboard.turn == "w":
-        tensor[:, :, 12] = 1.0
+    planes[12] = 1.0 if chessboard.turn == "w" else 0.0
     
-    # Castling rights
-    if chessboard.castling_rights["w"]["kingside"]:  tensor[:, :, 13] = 1.0
-    if chessboard.castling_rights["w"]["queenside"]: tensor[:, :, 14] = 1.0
-    if chessboard.castling_rights["b"]["kingside"]:  tensor[:, :, 15] = 1.0
-    if chessboard.castling_rights["b"]["queenside"]: tensor[:, :, 16] = 1.0
+    # Castling rights, only refilled when they changed
+    for channel, colour, side in CASTLING_CHANNELS:
+        value = chessboard.castling_rights[colour][side]
+        if planes[channel, 0, 0] != value:
+            planes[channel] = float(value)
 
     # En passant
+    if prev_en_passant:
+        planes[17][prev_en_passant] = 0.0
     if chessboard.en_passant_target:
-        row, col = chessboard.en_passant_target
-        tensor[row, col, 17] = 1.0
+        planes[17][chessboard.en_passant_target] = 1.0
+
+@timed()
+def encode_board_state(chessboard):
+    return chessboard.planes.copy()
+
+@timed()
+def encode_batch(boards, out=None):
+    # Writes the planes of every board into one (N, 18, 8, 8) buffer, out may be a numpy array or a CPU tensor
+    if out is None:
+        out = np.empty((len(boards), 18, 8, 8), dtype=np.float32)
+    buffer = out.numpy() if hasattr(out, "numpy") else out
+
+    for i, chessboard in enumerate(boards):
+        buffer[i] = chessboard.planes
     
-    return tensor
\ No newline at end of file
+    return out
@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+OUTPUT = os.path.join("logs", "bench.json")
+BASELINE = os.path.join("logs", "bench_baseline.json")
+STAGES = ("movegen", "encode", "mask", "inference", "selfplay", "train", "import")
+BATCH_SIZES = (1, 32, 256)
+
+# Perft positions for move generation, nodes are counted so the work is the same on every run
+MOVEGEN_POSITIONS = (
+    ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", 3),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 2),
+    ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", 2),
+)
+
+def _best(function, repeat):
+    # Fastest of repeat runs in seconds, the least disturbed by whatever else the machine is doing
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _result(value, unit, better="higher"):
+    return {"value": value, "unit": unit, "better": better}
+
+def bench_movegen(args, boards):
+    from game.board import create_board
+    from game.perft import perft
+
+    results = {}
+    for backend in ("bitboard", "mailbox"):
+        positions = [(create_board(backend, fen), depth) for fen, depth in MOVEGEN_POSITIONS]
+        nodes = sum(perft(board, depth) for board, depth in positions)
+        seconds = _best(lambda: [perft(board, depth) for board, depth in positions], args.repeat)
+        results[f"movegen.{backend}"] = _result(nodes / seconds, "positions/s")
+    return results
+
+def bench_encode(args, boards):
+    from game.state import encode_batch, build_planes
+
+    # Both are quick, loop them so a run lasts long enough to time reliably
+    out = encode_batch(boards)
+    seconds = _best(lambda: [encode_batch(boards, out=out) for _ in range(100)], args.repeat)
+    rebuild = _best(lambda: [build_planes(board) for _ in range(10) for board in boards], args.repeat)
+    return {
+        "encode.batch": _result(100 * len(boards) / seconds, "boards/s"),
+        "encode.from_scratch": _result(10 * len(boards) / rebuild, "boards/s"),
+    }
+
+def bench_mask(args, boards):
+    import torch
+    from ai.utils import get_all_legal_moves_4096, legal_softmax, batched_legal_softmax
+
+    for board in boards:
+        board.legal_moves() # Move generation is measured on its own
+    seconds = _best(lambda: [torch.tensor(get_all_legal_moves_4096(board), dtype=torch.bool) for board in boards],
+                    args.repeat)
+
+    # Legal-move policy from logits, one position at a time and as one batch
+    torch.manual_seed(args.seed)
+    logits = torch.randn(len(boards), 4096)
+    single = _best(lambda: [legal_softmax(logits[i], board) for i, board in enumerate(boards)], args.repeat)
+    batched = _best(lambda: batched_legal_softmax(logits, boards), args.repeat)
+    return {
+        "mask.build": _result(len(boards) / seconds, "masks/s"),
+        "policy.single": _result(len(boards) / single, "positions/s"),
+        "policy.batched": _result(len(boards) / batched, "positions/s"),
+    }
+
+def bench_inference(args, boards):
+    import torch
+    from game.state import encode_batch
+
+    model = _seeded_model(args.seed)
+    states = torch.from_numpy(encode_batch([boards[i % len(boards)] for i in range(max(BATCH_SIZES))]))
+    results = {}
+    with torch.no_grad():
+        for batch in BATCH_SIZES:
+            inputs = states[:batch]
+            runs = max(1, 256 // batch) * 4
+            for _ in range(3):
+                model(inputs)
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                model(inputs)
+                times.append(time.perf_counter() - start)
+            times.sort()
+            results[f"inference.b{batch}.latency"] = _result(times[len(times) // 2] * 1000, "ms", "lower")
+            results[f"inference.b{batch}.throughput"] = _result(batch / times[len(times) // 2], "positions/s")
+    return results
+
+def bench_selfplay(args, boards):
+    import torch
+    from ai.selfplay import BatchedSelfPlay
+
+    model = _seeded_model(args.seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        self_play = BatchedSelfPlay(torch.device("cpu"), model, batch_size=args.games, sample=True, data_dir=data_dir)
+        torch.manual_seed(args.seed) # Same sampled moves, so the same games, every run
+        start = time.perf_counter()
+        self_play.play(args.games)
+        seconds = time.perf_counter() - start
+    return {"selfplay.games": _result(args.games * 60 / seconds, "games/min")}
+
+def bench_train(args, boards):
+    import torch
+    import torch.nn.functional as F
+    from game.state import encode_batch
+    from ai.shards import MAX_POLICY_MOVES
+    from ai.utils import pad_indices
+    from ai.train import train_one_epoch
+
+    torch.manual_seed(args.seed)
+    batch_size, num_batches = 32, 20
+    positions = [boards[i % len(boards)] for i in range(batch_size * num_batches)]
+    states = torch.from_numpy(encode_batch(positions))
+    # Sparse targets over the legal moves, padded like the replay buffer's
+    policy_index, valid = pad_indices([board.legal_indices() for board in positions])
+    policy_prob = torch.softmax(torch.randn(policy_index.shape).masked_fill(~valid, float("-inf")), dim=1)
+    padding = MAX_POLICY_MOVES - policy_index.shape[1]
+    policy_index, policy_prob = F.pad(policy_index, (0, padding)), F.pad(policy_prob, (0, padding))
+    values = torch.rand(len(states), 1) * 2 - 1
+    batches = [(states[i:i + batch_size], policy_index[i:i + batch_size], policy_prob[i:i + batch_size],
+                values[i:i + batch_size]) for i in range(0, len(states), batch_size)]
+
+    model = _seeded_model(args.seed)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    # train_one_epoch logs to logs/training_loss.csv, keep the bench out of the real log
+    with tempfile.TemporaryDirectory() as scratch, contextlib.chdir(scratch), contextlib.redirect_stdout(io.StringIO()):
+        train_one_epoch(model, batches[:2], optimizer, torch.device("cpu"), 0) # Warm up
+        seconds = _best(lambda: train_one_epoch(model, batches, optimizer, torch.device("cpu"), 0), args.repeat)
+    return {"train.samples": _result(len(states) / seconds, "samples/s")}
+
+def bench_import(args, boards):
+    from tools.importtime import report
+
+    return {f"import.{module}": _result(min(report(module)["total_ms"] for _ in range(args.repeat)), "ms", "lower")
+            for module in ("app", "ui.main_window")}
+
+BENCHES = {
+    "movegen": bench_movegen,
+    "encode": bench_encode,
+    "mask": bench_mask,
+    "inference": bench_inference,
+    "selfplay": bench_selfplay,
+    "train": bench_train,
+    "import": bench_import,
+}
+
+def _seeded_model(seed):
+    # Fresh weights from a fixed seed, trained weights would make the numbers depend on model/
+    import torch
+    from ai.model import GoldfishModel
+
+    torch.manual_seed(seed)
+    return GoldfishModel().eval()
+
+def environment():
+    import torch
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+def compare(results, baseline, tolerance=0.15, tolerances=None):
+    # Returns [(name, value, baseline value, change)] for metrics worse than their tolerance allows
+    tolerances = tolerances or {}
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference or not reference["value"]:
+            continue
+        change = result["value"] / reference["value"] - 1
+        allowed = tolerances.get(name, tolerance)
+        if (change < -allowed) if result["better"] == "higher" else (change > allowed):
+            regressions.append((name, result["value"], reference["value"], change))
+    return regressions
+
+def run(stages=STAGES, seed=0, repeat=3, games=8, positions=256, threads=None):
+    import torch
+    from ai.export import sample_positions
+
+    if threads:
+        torch.set_num_threads(threads)
+    args = argparse.Namespace(seed=seed, repeat=repeat, games=games)
+    boards = sample_positions(positions, seed=seed)
+
+    results = {}
+    for stage in stages:
+        start = time.perf_counter()
+        results.update(BENCHES[stage](args, boards))
+        print(f"{stage} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return results
+
+def _parse_tolerances(values):
+    tolerances = {}
+    for value in values:
+        name, _, tolerance = value.partition("=")
+        tolerances[name] = float(tolerance)
+    return tolerances
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="app.py bench", description="Throughput of each stage on CPU")
+    parser.add_argument("stages", nargs="*", metavar="stage", help=f"any of {', '.join(STAGES)} (default all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage, the best one counts")
+    parser.add_argument("--games", type=int, default=8, help="self-play games, played in one batch")
+    parser.add_argument("--positions", type=int, default=256, help="fixed positions for encode, mask and train")
+    parser.add_argument("--threads", type=int, help="torch threads, default torch's own choice")
+    parser.add_argument("--output", default=OUTPUT)
+    parser.add_argument("--baseline", default=BASELINE, help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    parser.add_argument("--tolerance-for", action="append", default=[], metavar="METRIC=TOL",
+                        help="per metric tolerance, e.g. selfplay.games=0.3")
+    args = parser.parse_args(argv)
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage {', '.join(sorted(unknown))}")
+
+    results = run(args.stages or STAGES, args.seed, args.repeat, args.games, args.positions, args.threads)
+    report = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "environment": environment(), "results": results}
+
+    try:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        baseline = None
+
+    reference = baseline["results"] if baseline else {}
+    for name, result in results.items():
+        line = f"{name:<30}{result['value']:>14.1f} {result['unit']:<12}"
+        if name in reference and reference[name]["value"]:
+            line += f" {100 * (result['value'] / reference[name]['value'] - 1):+6.1f}%"
+        print(line)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return report
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return report
+    if baseline["environment"] != report["environment"]:
+        print(f"Warning: baseline was recorded on {baseline['environment']}")
+
+    regressions = compare(results, reference, args.tolerance, _parse_tolerances(args.tolerance_for))
+    for name, value, base, change in regressions:
+        print(f"REGRESSION {name}: {value:.1f} vs {base:.1f} ({100 * change:+.1f}%)")
+    if regressions:
+        sys.exit(1)
+    print("No regressions")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each entry point is expected to import, the GUI must start without these
+DEFAULT_MODULES = ("app", "ui.main_window", "ai.train")
+HEAVY_MODULES = ("torch", "numpy", "PyQt6")
+
+def import_times(module, python=sys.executable):
+    # Runs `python -X importtime -c "import module"` in a fresh interpreter, returns
+    # [(name, depth, self_us, cumulative_us)] in the order the imports finished
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+def report(module, top=10, python=sys.executable):
+    rows = import_times(module, python)
+    names = {name for name, _, _, _ in rows}
+    total = sum(cumulative for _, depth, _, cumulative in rows if depth == 0)
+    slowest = sorted(rows, key=lambda row: row[3], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_ms": total / 1000,
+        "modules": len(rows),
+        "heavy": {heavy: heavy in names for heavy in HEAVY_MODULES},
+        "slowest": [{"name": name, "cumulative_ms": cumulative / 1000, "self_ms": self_us / 1000}
+                    for name, _, self_us, cumulative in slowest],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="app.py importtime", description="Cold import time per entry point")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES))
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    reports = []
+    for module in args.modules:
+        result = report(module, args.top)
+        reports.append(result)
+        loaded = ", ".join(name for name, present in result["heavy"].items() if present) or "none"
+        print(f"{module}: {result['total_ms']:.1f} ms, {result['modules']} modules, heavy: {loaded}")
+        for entry in result["slowest"]:
+            print(f"    {entry['cumulative_ms']:9.1f} ms  {entry['name']}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(reports, file, indent=2)
+    return reports
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# Imported by game.board, so only what the timers need is imported up front
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Set GOLDFISH_INSTRUMENT=1 to time the hot paths. When it is off @timed returns the function itself,
+# so instrumented code runs exactly as before. It is read when the instrumented modules are imported.
+ENABLED = os.environ.get("GOLDFISH_INSTRUMENT", "") not in ("", "0")
+OUTPUT = os.path.join("logs", "profile") # .json and .csv, next to logs/training_loss.csv
+
+class Timer():
+    # Calls, total and a log-scale histogram (4 buckets per power of two, ~12% wide) for the percentiles
+    __slots__ = ("name", "calls", "total_ns", "buckets")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_ns = 0
+        self.buckets = [0] * 256
+
+    def record(self, ns):
+        self.calls += 1
+        self.total_ns += ns
+        bits = ns.bit_length()
+        self.buckets[(bits << 2) | ((ns >> (bits - 3)) & 3) if bits > 3 else bits << 2] += 1
+
+    def percentile(self, q):
+        target = q * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                bits, sub = index >> 2, index & 3
+                if bits <= 3:
+                    return float(1 << bits >> 1)
+                low = (4 | sub) << (bits - 3)
+                return low + (1 << (bits - 3)) / 2 # Middle of the bucket
+        return 0.0
+
+timers = {}
+counters = Counter()
+
+def enable():
+    # Only affects modules imported afterwards
+    global ENABLED
+    ENABLED = True
+    os.environ["GOLDFISH_INSTRUMENT"] = "1"
+
+def get_timer(name):
+    timer = timers.get(name)
+    if timer is None:
+        timer = timers[name] = Timer(name)
+    return timer
+
+def timed(name=None):
+    # Decorator, times every call of the function (inclusive of what it calls)
+    def decorate(function):
+        if not ENABLED:
+            return function
+        timer = get_timer(name or function.__qualname__)
+        clock = time.perf_counter_ns
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer.record(clock() - start)
+        return wrapper
+    return decorate
+
+@contextmanager
+def _block(timer):
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        timer.record(time.perf_counter_ns() - start)
+
+class _Nothing():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOTHING = _Nothing()
+
+def timer(name):
+    # `with timer("phase"):` for a block, meant for per-batch phases rather than per-call hot paths
+    return _block(get_timer(name)) if ENABLED else _NOTHING
+
+def timed_iter(iterable, name):
+    # Times how long each next() takes, e.g. waiting on a DataLoader
+    if not ENABLED:
+        return iterable
+    return _timed_iter(iterable, get_timer(name))
+
+def _timed_iter(iterable, timer):
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter_ns()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        timer.record(time.perf_counter_ns() - start)
+        yield item
+
+def count(name, n=1):
+    if ENABLED:
+        counters[name] += n
+
+def reset():
+    # Zeroed in place, decorated functions hold on to their Timer
+    for timer in timers.values():
+        timer.calls = timer.total_ns = 0
+        timer.buckets = [0] * 256
+    counters.clear()
+
+def snapshot():
+    rows = []
+    for timer in sorted(timers.values(), key=lambda timer: timer.total_ns, reverse=True):
+        if timer.calls:
+            rows.append({
+                "name": timer.name,
+                "calls": timer.calls,
+                "total_ms": timer.total_ns / 1e6,
+                "mean_us": timer.total_ns / timer.calls / 1e3,
+                "p50_us": timer.percentile(0.50) / 1e3,
+                "p99_us": timer.percentile(0.99) / 1e3,
+            })
+    return {"timers": rows, "counters": dict(counters)}
+
+def export(prefix=OUTPUT):
+    # Writes prefix.json and prefix.csv, counters go in the csv as rows with only calls filled in
+    import csv, json
+    stats = snapshot()
+    os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+    with open(prefix + ".json", "w") as file:
+        json.dump(stats, file, indent=2)
+
+    columns = ["name", "calls", "total_ms", "mean_us", "p50_us", "p99_us"]
+    with open(prefix + ".csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, restval="")
+        writer.writeheader()
+        writer.writerows(stats["timers"])
+        writer.writerows({"name": name, "calls": value} for name, value in stats["counters"].items())
+    return stats
+
+def report(stats=None, wall=None):
+    stats = stats or snapshot()
+    lines = [f"{'phase':<34}{'calls':>10}{'total ms':>11}{'share':>7}{'mean us':>10}{'p50 us':>9}{'p99 us':>9}"]
+    for row in stats["timers"]:
+        share = f"{100 * row['total_ms'] / (wall * 1000):.0f}%" if wall else ""
+        lines.append(f"{row['name']:<34}{row['calls']:>10}{row['total_ms']:>11.1f}{share:>7}"
+                     f"{row['mean_us']:>10.1f}{row['p50_us']:>9.1f}{row['p99_us']:>9.1f}")
+    for name, value in stats["counters"].items():
+        lines.append(f"{name:<34}{value:>10}")
+    return "\n".join(lines)
+
+
+class Sampler():
+    # Statistical profiler, looks at the stack of one thread every interval seconds.
+    # Cheaper than cProfile on call-heavy code, so the breakdown is closer to an unprofiled run.
+
+    def __init__(self, interval=0.001, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.own = Counter()
+        self.inclusive = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[_frame_name(frame)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(_frame_name(frame))
+                frame = frame.f_back
+            self.inclusive.update(seen)
+
+    def report(self, top=20):
+        lines = [f"{self.samples} samples every {self.interval * 1000:g} ms",
+                 f"{'own':>7}{'incl':>7}  function"]
+        for name, own in self.own.most_common(top):
+            lines.append(f"{100 * own / self.samples:>6.1f}%{100 * self.inclusive[name] / self.samples:>6.1f}%  {name}")
+        return "\n".join(lines)
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="app.py profile", description="Where self-play time goes")
+    parser.add_argument("--games", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=8, help="games played in lockstep")
+    parser.add_argument("--backend", default="bitboard", choices=("mailbox", "bitboard"))
+    parser.add_argument("--profiler", default="cprofile", choices=("cprofile", "sample", "none"),
+                        help="runs alongside the phase timers")
+    parser.add_argument("--interval", type=float, default=1.0, help="sampling interval in ms")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=OUTPUT, help="timer results go to OUTPUT.json and OUTPUT.csv")
+    args = parser.parse_args(argv)
+
+    enable()
+    import tempfile
+    import torch
+    from ai.model import GoldfishModel
+    from ai.selfplay import BatchedSelfPlay
+    from ai.checkpoints import MODEL_PATH
+
+    torch.manual_seed(args.seed)
+    model = GoldfishModel()
+    if os.path.exists(MODEL_PATH):
+        model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
+    model.eval()
+
+    # Games go to a scratch directory, profiling shouldn't feed the replay buffer
+    with tempfile.TemporaryDirectory() as data_dir:
+        self_play = BatchedSelfPlay(torch.device("cpu"), model, batch_size=args.batch_size, backend=args.backend,
+                                    sample=True, data_dir=data_dir)
+        reset()
+        profiler = sampler = None
+        if args.profiler == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif args.profiler == "sample":
+            sampler = Sampler(args.interval / 1000).start()
+
+        start = time.perf_counter()
+        self_play.play(args.games)
+        wall = time.perf_counter() - start
+
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.stop()
+
+    stats = export(args.output)
+    positions = counters["selfplay.positions"]
+    print(f"{args.games} games, {positions} positions in {wall:.2f}s "
+          f"({args.games / wall:.2f} games/s, {positions / wall:.0f} positions/s)")
+    print(report(stats, wall))
+    print(f"Timers written to {args.output}.json and {args.output}.csv")
+
+    if profiler:
+        import pstats
+        print()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.top)
+    if sampler:
+        print()
+        print(sampler.report(args.top))
+    return stats
+
+if __name__ == "__main__":
+    main()
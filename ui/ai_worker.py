@@ -0,0 +1,42 @@
+import copy
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from game.move import move_to_uci
+
+class AIMoveThread(QThread):
+    # Runs one search on a copy of the board so the UI thread can keep drawing the real one.
+    # Results arrive through signals, a cancelled search emits nothing.
+    progress = pyqtSignal(int, int, float, str)   # depth, nodes, nodes per second, best line
+    move_ready = pyqtSignal(int)                  # compact move
+
+    def __init__(self, search, board, parent=None):
+        super().__init__(parent)
+        self.search = search
+        self.board = copy.deepcopy(board)
+        self.cancelled = False
+        search.stopped = False # A stop() left over from an earlier cancelled move must not end this one
+
+    def run(self):
+        if self.cancelled:
+            return
+        move = self.search.search(self.board, on_iteration=self._report)
+        if move is not None and not self.cancelled:
+            self.move_ready.emit(move)
+
+    def cancel(self):
+        # Returns once the search has unwound, it checks the stop flag every node
+        self.cancelled = True
+        self.search.stop()
+        self.wait()
+
+    def _report(self, depth, score, nodes, seconds, line):
+        if self.cancelled:
+            return
+        names = []
+        for move in line:
+            from_sq = (move >> 6) & 63
+            names.append(move_to_uci(move, self.board.board[from_sq // 8][from_sq % 8]))
+            self.board.push(move)
+        for _ in line:
+            self.board.pop()
+        self.progress.emit(depth, nodes, nodes / seconds if seconds else 0.0, " ".join(names))
@@ -1,40 +1,61 @@
 import os
 from PyQt6.QtWidgets import (
-    QMainWindow, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QGridLayout, QInputDialog
+    QMainWindow, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QGridLayout, QInputDialog, QLabel, QLayout
 )
 from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QPixmap
-
 from ui.widgets import ClickableSquare
 from ui.promotion_dialog import PromotionDialog
+from ui.sprites import SpriteAtlas
+from ui.ai_worker import AIMoveThread
+
+from game.board import create_board
+from game.move import decode_move, move_to_uci
 
-from game.board import ChessBoard
+MODEL_PATH = os.path.join("model", "goldfish_model.pt")
+AI_TIME_LIMIT = 1.0 # Seconds per AI move
+SQUARE_SIZE = 80
+MIN_SQUARE_SIZE = 24
 
 class ChessMainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, backend="mailbox"):
         super().__init__()
+        self.backend = backend
+        self.ai = None
+        self.ai_checkpoints = None
+        self.ai_colours = set() # Sides the AI plays
+        self.ai_thread = None
+        self.square_size = SQUARE_SIZE
+        self.sprites = SpriteAtlas()
+        self.sprites.preload(self.square_size)
         self.setWindowTitle("Goldfish V2")
-        self.setFixedSize(1024, 1024)
         self._setup_ui()
+        self.resize(1024, 1024)
 
     def _setup_ui(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
 
         main_layout = QVBoxLayout()
+        # The board follows the window size, so its current size mustn't stop the window from shrinking
+        main_layout.setSizeConstraint(QLayout.SizeConstraint.SetNoConstraint)
+        central_widget.setMinimumSize(8 * MIN_SQUARE_SIZE, 8 * MIN_SQUARE_SIZE)
         central_widget.setLayout(main_layout)
 
         top_button_layout =  QHBoxLayout()
         self._add_mode_button(top_button_layout)
         main_layout.addLayout(top_button_layout)
 
-        board_widget = QWidget()
-        board_widget.setFixedSize(640, 640)
+        self.board_widget = QWidget()
+        self.board_widget.setFixedSize(8 * self.square_size, 8 * self.square_size)
         self.board_layout = QGridLayout()
         self._init_chessboard(self.board_layout)
-        board_widget.setLayout(self.board_layout)
+        self.board_widget.setLayout(self.board_layout)
 
-        main_layout.addWidget(board_widget, alignment=Qt.AlignmentFlag.AlignCenter)
+        main_layout.addWidget(self.board_widget, alignment=Qt.AlignmentFlag.AlignCenter)
+
+        # AI search progress
+        self.status_label = QLabel("")
+        main_layout.addWidget(self.status_label, alignment=Qt.AlignmentFlag.AlignCenter)
 
     def _add_mode_button(self, layout):
         self.pvp_btn = QPushButton("Player vs Player")
@@ -45,15 +66,106 @@ class ChessMainWindow(QMainWindow):
         layout.addWidget(self.pvai_btn)
         layout.addWidget(self.aivai_btn)
         
+        self.pvp_btn.clicked.connect(self._start_pvp)
         self.pvai_btn.clicked.connect(self._show_colour_options)
+        self.aivai_btn.clicked.connect(self._start_aivai)
+
+    def _start_pvp(self):
+        self.ai_colours = set()
+        self._new_game()
 
     def _show_colour_options(self):
-        print("PvAI selected - placeholder")
+        colour, ok = QInputDialog.getItem(self, "Player vs AI", "Play as:", ["White", "Black"], 0, False)
+        if not ok:
+            return
+        self.ai_colours = {"b" if colour == "White" else "w"}
+        self._new_game()
+        self._start_ai_move()
+
+    def _start_aivai(self):
+        self.ai_colours = {"w", "b"}
+        self._new_game()
+        self._start_ai_move()
+
+    def _new_game(self):
+        self._cancel_ai()
+        self.status_label.setText("")
+        self.game_logic = create_board(self.backend)
+        self.selected_from = None
+        self.legal_moves = None
+        self._update_board_ui()
+
+    def _get_ai(self):
+        # torch and the model only load the first time the AI plays
+        if self.ai is None:
+            import torch
+            from ai.export import load_inference_model
+            from ai.search import AlphaBetaSearch
+            from ai.model import GoldfishModel
+            from ai.checkpoints import CheckpointWatcher, read_latest
+
+            # Exported TorchScript/int8/ONNX variant when one is faster, otherwise the fp32 weights
+            model, variant = load_inference_model(os.path.dirname(MODEL_PATH))
+            print(f"AI model: {variant}")
+            self.ai = AlphaBetaSearch(model, torch.device("cpu"), time_limit=AI_TIME_LIMIT)
+
+            # Generations saved by a running trainer load into an eager model, exported variants can't take new weights
+            self.ai_checkpoints = CheckpointWatcher(GoldfishModel().eval(), generation=read_latest())
+        elif self.ai_checkpoints.poll() is not None:
+            print(f"AI model: checkpoint generation {self.ai_checkpoints.generation}")
+            self.ai.model = self.ai_checkpoints.model
+        return self.ai
+
+    def _start_ai_move(self):
+        # Searches on a worker thread, the move comes back through _on_ai_move
+        if self.game_logic.turn not in self.ai_colours or self.game_logic.is_game_over():
+            return
+
+        self.ai_thread = AIMoveThread(self._get_ai(), self.game_logic, self)
+        self.ai_thread.progress.connect(self._on_ai_progress)
+        self.ai_thread.move_ready.connect(lambda move, thread=self.ai_thread: self._on_ai_move(thread, move))
+        self.ai_thread.finished.connect(self.ai_thread.deleteLater) # Parented to the window, would live until it closes
+        self.ai_thread.start()
+
+    def _cancel_ai(self):
+        if self.ai_thread is not None:
+            self.ai_thread.cancel()
+            self.ai_thread = None
+
+    def _on_ai_progress(self, depth, nodes, nodes_per_second, line):
+        self.status_label.setText(f"depth {depth}  |  {nodes} nodes  |  {nodes_per_second:.0f} nodes/s  |  {line}")
+
+    def _on_ai_move(self, thread, move):
+        if thread is not self.ai_thread:
+            return # Finished just before a reset, the move belongs to an old position
+        self.ai_thread = None
+
+        from_row, from_col, to_row, to_col, promotion = decode_move(move)
+        piece = self.game_logic.get_piece(from_row, from_col)
+        legal_moves = self.game_logic.get_legal_moves(from_row, from_col)
+        if self.game_logic.make_move(from_row, from_col, to_row, to_col, legal_moves, promotion):
+            print(f"AI played {move_to_uci(move, piece)}")
+        self._update_board_ui()
+        self._report_game_over()
+        self._start_ai_move()
+
+    def closeEvent(self, event):
+        self._cancel_ai()
+        super().closeEvent(event)
+
+    def _report_game_over(self):
+        result = self.game_logic.is_game_over()
+        if result == "checkmate":
+            winner = "White" if self.game_logic.turn == "b" else "Black"
+            print(f"Checkmate! {winner} wins.")
+        elif result:
+            print(result.capitalize())
 
     def _init_chessboard(self, layout):
-        self.game_logic = ChessBoard()
+        self.game_logic = create_board(self.backend)
 
         self.squares = [[None for _ in range(8)] for _ in range(8)]
+        self.rendered = [[None for _ in range(8)] for _ in range(8)] # Piece last drawn on each square
         self.selected_from = None
 
         layout.setSpacing(0)
@@ -61,7 +173,7 @@ class ChessMainWindow(QMainWindow):
         for row in range(8):
             for col in range(8):
                 square = ClickableSquare(row, col)
-                square.setFixedSize(80,80)
+                square.setFixedSize(self.square_size, self.square_size)
                 square.clicked.connect(self._on_square_clicked)
 
                 colour = "#f0d9b5" if (row + col) % 2 == 0 else "#b58863"
@@ -71,20 +183,48 @@ class ChessMainWindow(QMainWindow):
 
         self._update_board_ui()
         
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # Largest board that fits between the buttons and the status line
+        layout = self.centralWidget().layout()
+        margins = layout.contentsMargins()
+        width = self.centralWidget().width() - margins.left() - margins.right()
+        height = (self.centralWidget().height() - margins.top() - margins.bottom() - 2 * layout.spacing()
+                  - self.pvp_btn.sizeHint().height() - self.status_label.sizeHint().height())
+        size = max(min(width, height) // 8, MIN_SQUARE_SIZE)
+        if size != self.square_size:
+            self._set_square_size(size)
+
+    def _set_square_size(self, size):
+        # Every square gets redrawn with sprites scaled for the new size
+        self.square_size = size
+        self.rendered = [[None for _ in range(8)] for _ in range(8)]
+        for row in range(8):
+            for col in range(8):
+                self.squares[row][col].setFixedSize(size, size)
+        self.board_widget.setFixedSize(8 * size, 8 * size)
+        self._update_board_ui()
+
     def _update_board_ui(self):
+        # Only squares whose piece changed since the last draw are touched
         board_state = self.game_logic.get_board_state()
         for row in range(8):
+            rendered = self.rendered[row]
             for col in range(8):
                 piece = board_state[row][col]
+                if piece == rendered[col]:
+                    continue
                 square = self.squares[row][col]
                 if(piece):
-                    image_path = os.path.join("assets", "pieces", f"{piece}.png")
-                    pixmap = QPixmap(image_path)
-                    square.setPixmap(pixmap.scaled(80, 80, Qt.AspectRatioMode.KeepAspectRatio))
+                    square.setPixmap(self.sprites.get(piece, self.square_size))
                 else:
                     square.clear()
+                rendered[col] = piece
 
     def _on_square_clicked(self, row, col):
+        if self.game_logic.turn in self.ai_colours:
+            return
+
         if self.selected_from is None:
             print(self.game_logic.get_piece(row, col))
             if self.game_logic.get_piece(row, col) != "":
@@ -111,16 +251,12 @@ class ChessMainWindow(QMainWindow):
             moved = self.game_logic.make_move(from_row, from_col, row, col, self.legal_moves, promotion)
 
             if moved:
-                self._update_board_ui()
-                result = self.game_logic.is_game_over()
-                if result == "Checkmate":
-                    winner = "White" if self.chess_logic.turn == "b" else "Black"
-                    print(f"Checkmate! {winner} wins.")
-                elif result:
-                    print(result.capitalize())
+                self._report_game_over()
             else:
                 print("Invalid Move")
 
             self.selected_from = None
             self.legal_moves = None
-            self._update_board_ui()
\ No newline at end of file
+            self._update_board_ui()
+            if moved:
+                self._start_ai_move()
\ No newline at end of file
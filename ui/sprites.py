@@ -0,0 +1,28 @@
+import os
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QPixmap
+
+PIECES = [f"{colour}_{name}" for colour in "wb" for name in ("pawn", "knight", "bishop", "rook", "queen", "king")]
+
+class SpriteAtlas():
+    # Piece images read from disk once, each scaled once per square size. Needs a QApplication.
+
+    def __init__(self, directory=os.path.join("assets", "pieces")):
+        self.directory = directory
+        self.sources = {}
+        self.scaled = {}
+
+    def preload(self, size):
+        for piece in PIECES:
+            self.get(piece, size)
+
+    def get(self, piece, size):
+        pixmap = self.scaled.get((piece, size))
+        if pixmap is None:
+            source = self.sources.get(piece)
+            if source is None:
+                source = self.sources[piece] = QPixmap(os.path.join(self.directory, f"{piece}.png"))
+            pixmap = source.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio,
+                                   Qt.TransformationMode.SmoothTransformation)
+            self.scaled[(piece, size)] = pixmap
+        return pixmap